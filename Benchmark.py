@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+""" Benchmarks for the Iridium hot paths, run against IridiumSim's simulated 9602 (in a child process, so its CPU isn't counted).
+
+Usage: python Benchmark.py [scenario ...]
+
+Scenarios:
+    reader      CPU time waiting for a reply, old inWaiting() busy-wait reader against the buffered one.
+    commands    Wall and CPU time per AT command.
+    startup     Startup-to-ready time, configuration commands one at a time against Configure().
+    reconnect   Startup-to-ready time with buffer check, with no ModemState against a warm one.
+    sessions    Wall and CPU time per send session and messages per hour with a clear sky.
+    patchy      As sessions but with RF failures and signal dropouts."""
+import os, sys, time, threading
+import Iridium, IridiumSim
+
+SessionTime = 1.0                                                       # Simulated +SBDIX time. Real sessions take 10-60s.
+
+class PipePort(object):
+    """ Stands in for a serial.Serial. Anything written is answered with Reply after Delay seconds through an OS pipe, so select() and
+    inWaiting() behave like a real port."""
+
+    def __init__(self, Reply, Delay):
+        self.Reply = Reply
+        self.Delay = Delay
+        self.rfd, self.wfd = os.pipe()
+        self.waiting = 0
+        self.lock = threading.Lock()
+        self.timeout = 60
+
+    def fileno(self):
+        return self.rfd
+
+    def inWaiting(self):
+        with self.lock:
+            return self.waiting
+
+    def read(self, Size=1):
+        data = os.read(self.rfd, Size)
+        with self.lock:
+            self.waiting -= len(data)
+        return data
+
+    def write(self, Message):
+        threading.Timer(self.Delay, self._Answer).start()
+
+    def _Answer(self):
+        with self.lock:
+            self.waiting += len(self.Reply)
+        os.write(self.wfd, self.Reply)
+
+    def flushInput(self):
+        pass
+
+def LegacyReadToEndOfMessage(serialPort, EndChar, ExpectedReply, MaxTimeSec):
+    """ The reader as it was before RxBuffer: spins on inWaiting() and builds the message a character at a time."""
+    message = "  "
+    timeout = time.time() + MaxTimeSec
+
+    while time.time() < timeout:
+        if serialPort.inWaiting() == 0:
+            continue
+
+        char = serialPort.read(1)
+        message += char
+
+        if char == EndChar and ExpectedReply in message:
+            return message
+
+    return None
+
+def CpuTime():
+    times = os.times()
+    return times[0] + times[1]
+
+class Measure(object):
+    """ Accumulates wall and CPU time over a number of repetitions."""
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.count = 0
+
+    def __enter__(self):
+        self.startWall, self.startCpu = time.time(), CpuTime()
+        return self
+
+    def __exit__(self, *args):
+        self.wall += time.time() - self.startWall
+        self.cpu += CpuTime() - self.startCpu
+        self.count += 1
+
+def Report(Name, measure, Extra=""):
+    print("%-28s wall %8.3fs  cpu %8.4fs  per op (%d ops)%s" % (Name, measure.wall / measure.count, measure.cpu / measure.count, measure.count, Extra))
+
+def Simulated(**kwargs):
+    sim = IridiumSim.Simulator(**kwargs).StartProcess()
+    return sim, Iridium.OpenSerial(sim.Port, 19200)
+
+def Reader(Delay=0.5, Commands=5):
+    reply = "AT+SBDIX\r\r\n+SBDIX: 0, 12, 0, -1, 0, 0\r\n\r\nOK\r\n"
+
+    readers = (("reader before", lambda port: LegacyReadToEndOfMessage(port, '\r', "+SBDIX:", 10)),
+               ("reader after", lambda port: Iridium.ReadReply(port, "AT+SBDIX\r", "+SBDIX", 10)))
+
+    for name, reader in readers:
+        port = PipePort(reply, Delay)
+        measure = Measure()
+        for _ in range(Commands):
+            port.write("AT+SBDIX\r")
+            with measure:
+                reader(port)
+        Report(name, measure, ", %.1fs reply delay" % Delay)
+
+def Commands(Repeats=20):
+    sim, serialPort = Simulated(Delays={"+CSQ": 0.2, "+SBDSX": 0.05})
+
+    for name, function in (("AT", Iridium.CheckConnected), ("AT+CSQ", Iridium.CheckSignalStrength), ("AT+SBDSX", Iridium.GetSbdStatus)):
+        measure = Measure()
+        for _ in range(Repeats):
+            with measure:
+                function(serialPort)
+        Report("command " + name, measure)
+
+    serialPort.close()
+    sim.Stop()
+
+def Startup(Repeats=5):
+    sim, serialPort = Simulated(Delays={"turnaround": 0.1})
+
+    individually = Measure()
+    chained = Measure()
+    for _ in range(Repeats):
+        with individually:
+            Iridium.CheckConnected(serialPort) and Iridium.StartReporting(serialPort) and Iridium.EnableRing(serialPort) and Iridium.StartAutoRegister(serialPort)
+        with chained:
+            Iridium.CheckConnected(serialPort) and Iridium.Configure(serialPort)
+
+    Report("startup one at a time", individually)
+    Report("startup Configure()", chained)
+
+    serialPort.close()
+    sim.Stop()
+
+def Reconnect(Repeats=5):
+    sim, serialPort = Simulated(Delays={"turnaround": 0.1})
+
+    cold = Measure()
+    warm = Measure()
+    for _ in range(Repeats):
+        Iridium.ModemStates.clear()                                     # As after a restart without a state file.
+        with cold:
+            Iridium.CheckConnected(serialPort) and Iridium.Configure(serialPort)
+            Iridium.ClearBufferDebug(serialPort)
+        with warm:
+            Iridium.CheckConnected(serialPort) and Iridium.Configure(serialPort)
+            Iridium.ClearBufferDebug(serialPort, MaxAge=3600)
+
+    Report("reconnect cold", cold)
+    Report("reconnect warm", warm)
+
+    serialPort.close()
+    sim.Stop()
+
+def Sessions(Name="sessions", Messages=10, **kwargs):
+    sim, serialPort = Simulated(Delays={"+SBDIX": SessionTime}, **kwargs)
+
+    measure = Measure()
+    for i in range(Messages):
+        with measure:
+            Iridium.BufferSbdMessage(serialPort, "Antenna status %d" % i)
+            Iridium.InitiateSBD(serialPort)
+
+    Report(Name, measure, ", %.0f msgs/hour at %.1fs per session" % (3600.0 * measure.count / measure.wall, SessionTime))
+
+    serialPort.close()
+    sim.Stop()
+
+def Patchy():
+    Sessions("patchy", MoStatus=[18, 0, 17, 0, 0, 32, 0, 18, 18, 0], Signal=lambda t: 0 if int(t) % 10 >= 8 else 3)
+
+Scenarios = {"reader": Reader, "commands": Commands, "startup": Startup, "reconnect": Reconnect, "sessions": Sessions, "patchy": Patchy}
+
+if __name__ == "__main__":
+    for scenario in sys.argv[1:] or ["reader", "commands", "startup", "reconnect", "sessions", "patchy"]:
+        Scenarios[scenario]()
@@ -1,35 +1,149 @@
 #!/usr/bin/env python
 """ Main RockBLOCK Iridium functions. """
-import cgi, cgitb, time
+import cgi, cgitb, time, select, struct, threading, functools, atexit, json, os
+try:
+    import Queue
+except ImportError:                                                                     # Python 3
+    import queue as Queue
 import serial
 import Globals
+import IridiumMetrics
 import logging, logging.handlers, traceback
 import zmq
+from collections import deque, namedtuple
 from datetime import datetime
 
 DEBUG = False
 ZmqSock = None
 
+MaxMoBytes = 340                                                                        # Largest message the 9602 will take with AT+SBDWB.
+MaxMtBytes = 270                                                                        # Largest MT message the gateway will deliver to a 9602.
+MaxTextBytes = 120                                                                      # Largest text message the 9602 will take with AT+SBDWT.
+SessionTimeout = 60                                                                     # Seconds to wait for the +SBDIX reply. Never cut short, the modem is still in the session till it answers.
+
 my_logger = logging.getLogger('IridiumLogger')
 my_logger.setLevel(logging.DEBUG)
 handler = logging.handlers.RotatingFileHandler(Globals.IridiumLog, maxBytes=1000000, backupCount=2)
 my_logger.addHandler(handler)
 
-def Log(Message):
-    Message = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S:%f')[:-3] + "," + Message
+LogLevel = logging.DEBUG                                                                # Messages below this level are dropped before any work is done.
+RepeatWindow = 60                                                                       # Seconds a rate limited message is held back for after being logged.
+LogQueue = Queue.Queue(maxsize=10000)
+LogRepeats = {}                                                                         # Rate limited message -> [time last logged, times held back since]
+LogDropped = [0]
+LogLock = threading.Lock()                                                              # Guards LogRepeats and LogDropped, Log() is called from many threads.
+
+def Log(Message, Level=logging.DEBUG, Args=None, RateLimit=False):
+    """ Queues Message for the log worker thread, which does the timestamp formatting, file writing and ZMQ publishing, so logging never
+    holds up the serial paths. With Args the Message % Args formatting is left to the worker too. A RateLimit message is logged at most
+    once per RepeatWindow, with a count of the repeats held back."""
+    if Level < LogLevel:
+        return
+
+    now = time.time()
+
+    if RateLimit:
+        with LogLock:
+            repeat = LogRepeats.get(Message)
+            if repeat is not None and now - repeat[0] < RepeatWindow:
+                repeat[1] += 1
+                return
+            if len(LogRepeats) > 256:
+                LogRepeats.clear()
+            LogRepeats[Message] = [now, 0]
+        if repeat is not None and repeat[1]:
+            Message = Message + " (repeated " + str(repeat[1]) + " times)"
+
+    try:
+        LogQueue.put_nowait((now, Level, Message, Args))
+    except Queue.Full:
+        with LogLock:
+            LogDropped[0] += 1
+
+def LogWorker():
+    """ Formats and writes queued log records till StopLog() queues None. Also publishes the IridiumMetrics snapshot every
+    IridiumMetrics.Interval seconds, as it owns the ZMQ socket."""
+    published = time.time()
+
+    while True:
+        try:
+            record = LogQueue.get(timeout=max(0.1, published + IridiumMetrics.Interval - time.time()) if IridiumMetrics.Interval else 1)
+        except Queue.Empty:
+            record = ()
+
+        if IridiumMetrics.Interval and time.time() >= published + IridiumMetrics.Interval:
+            published = time.time()
+            PublishMetrics()
+
+        if record is None:                                                              # From StopLog().
+            return
+
+        if not record:
+            continue
+
+        created, level, message, args = record
 
-    if DEBUG:
-        print Message
+        try:
+            if args is not None:
+                message = message % args
+
+            with LogLock:
+                dropped, LogDropped[0] = LogDropped[0], 0
+            if dropped:
+                message += " (" + str(dropped) + " log messages dropped, queue full)"
+
+            message = datetime.utcfromtimestamp(created).strftime('%Y-%m-%d %H:%M:%S:%f')[:-3] + "," + message
 
-    my_logger.debug(Message)
+            if DEBUG:
+                print(message)
 
-    if ZmqSock:
-        ZmqSock.send_multipart([b"IridiumLog", Message])                                    # Outgoing ZMQ data.
+            my_logger.log(level, message)
+
+            if ZmqSock:
+                ZmqSock.send_multipart([b"IridiumLog", message if isinstance(message, bytes) else message.encode("utf-8")])   # Outgoing ZMQ data.
+        except Exception:
+            traceback.print_exc()
+
+def PublishMetrics():
+    """ Sends the IridiumMetrics snapshot on the ZMQ socket. Called from the log worker thread."""
+    if not ZmqSock:
+        return
+
+    try:
+        ZmqSock.send_multipart([b"IridiumMetrics", IridiumMetrics.metrics.Encode()])
+    except Exception:
+        traceback.print_exc()
+
+def StopLog(Timeout=5):
+    """ Writes out the messages logged so far and stops the log worker, before interpreter shutdown can pull the module out from under it.
+    Registered to run at exit."""
+    LogQueue.put(None)
+    LogThread.join(Timeout)
+
+LogThread = threading.Thread(target=LogWorker, name="IridiumLog")
+LogThread.daemon = True
+LogThread.start()
+atexit.register(StopLog)
 
 def SetZmqSock(Socket):
+    """ Publishes log lines, and IridiumMetrics every IridiumMetrics.Interval seconds, on Socket. They're sent from the log worker thread, so
+    as ZMQ sockets aren't thread safe the socket mustn't be used elsewhere while it's set here."""
     global ZmqSock
     ZmqSock = Socket
 
+def SetLogLevel(Level):
+    global LogLevel
+    LogLevel = Level
+
+def Exclusive(Function):
+    """ Holds the port's lock while Function runs so a Dispatcher can't read the port from under a command in flight."""
+    @functools.wraps(Function)
+    def Wrapper(serialPort, *args, **kwargs):
+        with GetRxBuffer(serialPort).lock:
+            return Function(serialPort, *args, **kwargs)
+
+    return Wrapper
+
 def OpenSerial(Port, Baud):
     serialPort = serial.Serial(port=Port,\
                                baudrate=Baud,\
@@ -60,7 +174,7 @@ def StartReporting(serialPort):
     the DTE after reservation; otherwise forward them directly to the DTE."""
     Log("StartReporting()")
 
-    if not WriteAndCheck(serialPort, "AT+CIER=1,0,1\r", "OK", 40):
+    if not WriteAndCheck(serialPort, "AT+CIER=1,1,1\r", "OK", 40):
         Log("Issue Starting Reporting.")
         return False
 
@@ -85,21 +199,24 @@ def WaitForSigStr(serialPort, MinSigStr, Timeout):
 
     signalStr = 0
 
-    timeout = time.time() + Timeout                                     # Set the timeout time
+    with IridiumMetrics.Timer("WaitForSigStr") as timer:
+        timeout = time.time() + Timeout                                 # Set the timeout time
+
+        while time.time() < timeout:                                    # Run the loop till the time out is reached or the ExpectedReply is found with an end of line.
 
-    while time.time() < timeout:                                        # Run the loop till the time out is reached or the ExpectedReply is found with an end of line.
+            signalStr = CheckSignalStrength(serialPort)
 
-        signalStr = CheckSignalStrength(serialPort)
+            #if signalStr == None:
+            #    Log("Not getting a signal strength from unit.")
+            #    return
 
-        #if signalStr == None:
-        #    Log("Not getting a signal strength from unit.")
-        #    return
+            if signalStr > MinSigStr:
+                return True
+            else:
+                Log("Signal Strength Too Weak", logging.INFO, RateLimit=True)
+                Sleep(3)
 
-        if signalStr > MinSigStr:
-            return True
-        else:
-            Log("Signal Strength Too Weak")
-            time.sleep(3)
+        timer.Ok = False
 
     Log("WaitForSigStr() Timed Out.")
     return False
@@ -110,98 +227,215 @@ def CheckSignalStrength(serialPort):
 
     Log("CheckSignalStrength()")
 
-    reply = WriteAndReceive(serialPort, "AT+CSQ\r", "+CSQ:", '\r', 40)
+    reply = Query(serialPort, "AT+CSQ\r", "+CSQ", 40)
 
-    if reply is not None:
-        index = reply.index("+CSQ:") + 5
-        Log("Strength: " + reply[index])
-        return int(reply[index])
-    else:
+    if reply is None:
         return None
 
-def WriteAndReceive(serialPort, WriteCommand, Response, EOL, Timeout):
-    """ Sends a message, reads to specified response is detected and EOL then returns read message."""
-
-    try:
-        Log("Sending Command: " + WriteCommand)
-
-        SerialWrite(serialPort, WriteCommand)
-
-        reply = ReadToEndOfMessage(serialPort, EOL, Response, Timeout)
+    Log("Strength: %s", Args=(reply.Signal,))
+    IridiumMetrics.metrics.Signal(reply.Signal)
+    return reply.Signal
 
-        return reply
-
-    except:
-        Log("Unexpected Error:")
-        Log(traceback.format_exc())
+class RxBuffer(object):
+    """ Incremental receive buffer for a serial port. Blocks on the port till data arrives instead of polling inWaiting() and reads
+    everything waiting in one go, so a long wait for a reply costs no CPU and the message isn't built up a character at a time."""
 
-def ReadToEndOfMessage(serialPort, EndChar, ExpectedReply, MaxTimeSec):
-    """ Continues reading serial port till ExpectedReply and EndChar are detected or timeout is reached."""
-    message = "  "
-    char = ""
-
-    timeout = time.time() + MaxTimeSec                                  # Set the timeout time
+    def __init__(self, serialPort):
+        self.serialPort = serialPort
+        self.data = bytearray()
+        self.lock = threading.RLock()
+        self.lineScan = 0                                               # Start of the first line not yet checked for unsolicited result codes.
+        self.unsolicited = deque(maxlen=100)                            # (code, values) waiting for a Dispatcher to hand them out.
+        self.OnUnsolicited = None                                       # Optional callback(code, values), called as soon as a code is read.
 
-    while time.time() < timeout:                                        # Run the loop till the time out is reached or the ExpectedReply is found with an end of line.
+    def Fill(self, Timeout):
+        """ Waits up to Timeout seconds for data and appends whatever is waiting to the buffer. Returns number of bytes added."""
         try:
-            #Log("Chars in buffer: " + str(serialPort.inWaiting()))
-            if serialPort.inWaiting() == 0:                           # Number of chars in buffer
-                #Log("No Data In Buffer")
+            fileno = self.serialPort.fileno()
+        except Exception:
+            fileno = None
+
+        if fileno is not None:
+            readable, _, _ = select.select([fileno], [], [], Timeout)
+            if not readable:
+                return 0
+            with self.lock:
+                waiting = self.serialPort.inWaiting()
+                if waiting == 0:                                        # Another thread read it first.
+                    return 0
+                chunk = self.serialPort.read(waiting)
+        else:                                                           # No OS handle to wait on (e.g. Windows), block inside read() instead.
+            portTimeout = self.serialPort.timeout
+            self.serialPort.timeout = Timeout
+            try:
+                chunk = self.serialPort.read(1)
+            finally:
+                self.serialPort.timeout = portTimeout
+            if chunk:
+                chunk += self.serialPort.read(self.serialPort.inWaiting())
+
+        self.data.extend(chunk)
+        self.ScanUnsolicited()
+        return len(chunk)
+
+    def ScanUnsolicited(self):
+        """ Checks newly completed lines for unsolicited result codes and queues them for the Dispatcher. They're left in the buffer, command
+        readers skip over them."""
+        while True:
+            end = self.data.find('\r', self.lineScan)
+            if end < 0:
+                return
+
+            line = str(self.data[self.lineScan:end]).strip()
+            self.lineScan = end + 1
+
+            if line.startswith(UnsolicitedCodes):
+                code, values = ParseUnsolicited(line)
+                self.unsolicited.append((code, values))
+                if self.OnUnsolicited:
+                    self.OnUnsolicited(code, values)
+
+    def ReadLine(self, Deadline):
+        """ Returns the next non-empty line, without CR/LF, or None if the Deadline time passes first."""
+        scanned = 0
+
+        while True:
+            index = self.data.find('\r', scanned)
+
+            if index >= 0:
+                line = self.Take(index + 1).strip()
+                if line:
+                    return line
+                scanned = 0
                 continue
 
-            char = serialPort.read(1)
-            #Log("Char Read: " + char)
-            message += char                                             # Add new character to message
+            scanned = len(self.data)
 
-            if char == EndChar:                                         # End characted been detected.
-                #Log("End char detected...")
-                if ExpectedReply in message:                              # Check if the expected reply is within the message so far. If yes return.
-                    #Log("Expected Reply Recieved.")
-                    return message
+            remaining = Deadline - time.time()
+            if remaining <= 0:
+                return None
 
-        except Exception, e:
-            Log("2 Error : " +str(e))
-            break
+            self.Fill(remaining)
 
-    Log("Iridium.ReadToEndOfMessage() - End Of Loop, Didn't Get Expected Reply Message: ")
-    Log(message)
-    Log("***********ReadToEndOfMessage() DEBUG - Checking Message been buffered:")
-    ShortBurstDataStatus(serialPort)
-    Log("**************************")
-    time.sleep(2)
-    return None
+    def Wait(self, Length, Deadline):
+        """ Waits till the buffer holds at least Length bytes. Returns False if the Deadline time passes first."""
+        while len(self.data) < Length:
+            remaining = Deadline - time.time()
+            if remaining <= 0:
+                return False
 
-def CheckForReply(serialPort, ExpectedReply, Timeout):
-    """ Read serial port till an ExpectedReply string is read or timeout. Return true if found, false if not."""
-    message = "  "
-    char = ""
+            self.Fill(remaining)
 
-    timeout = time.time() + Timeout                                     # Set the timeout time
+        return True
 
-    while time.time() < timeout:                                        # Run the loop till the time out is reached or the ExpectedReply is found with an end of line.
-        try:
+    def Take(self, Length):
+        """ Removes and returns the first Length bytes of the buffer."""
+        message = str(self.data[:Length])
+        del self.data[:Length]
+        self.lineScan = max(0, self.lineScan - Length)
+        return message
 
-            if serialPort.inWaiting() == 0:                             # Number of chars in buffer
-                #Log("No Data In Buffer")
-                continue
+    def Clear(self):
+        del self.data[:]
+        self.lineScan = 0
 
-            char = serialPort.read(1)
-            #Log("Char Read: " + char)
+RxBuffers = {}
 
-            message += char                                             # Add new character to message
+def GetRxBuffer(serialPort):
+    """ Returns the receive buffer for serialPort, creating it on first use."""
+    rxBuffer = RxBuffers.get(serialPort)
 
-            if ExpectedReply in message:                                # Check if the expected reply is within the message so far. If yes return.
-                #Log("Expected Reply Recieved.")
-                return True
+    if rxBuffer is None:
+        rxBuffer = RxBuffers[serialPort] = RxBuffer(serialPort)
 
-        except Exception, e:
-            Log("Error : " +str(e))
-            break
+    return rxBuffer
 
-    Log("Iridium.CheckForReply() - End Of Loop, Didn't Get Expected Reply Message:")
-    Log(message)
-    return False
 
+UnsolicitedCodes = ("SBDRING", "+CIEV:", "+AREG:")
+Subscribers = {}
+
+def ParseUnsolicited(Line):
+    """ Splits an unsolicited result code line into its code and list of integer values, e.g. "+CIEV:0,3" gives ("+CIEV", [0, 3])."""
+    code, _, values = Line.partition(':')
+
+    try:
+        return code, [int(value) for value in values.split(',') if value.strip()]
+    except ValueError:
+        return code, []
+
+def Subscribe(Code, Callback):
+    """ Calls Callback(serialPort, Code, Values) from the Dispatcher thread whenever the unsolicited result code Code ("SBDRING", "+CIEV" or
+    "+AREG") is received. +CIEV values are [0, signal strength] or [1, service available]. +AREG values are [event, registration error]."""
+    Subscribers.setdefault(Code, []).append(Callback)
+
+def Unsubscribe(Code, Callback):
+    if Callback in Subscribers.get(Code, []):
+        Subscribers[Code].remove(Callback)
+
+def Notify(serialPort, Code, Values):
+    """ Calls the subscribers to Code. Besides the unsolicited result codes, DrainSBD notifies "+SBDIX" with the six values of every
+    session's reply from the thread running the session, and "EXHAUSTED" when its RetryBudget runs out."""
+    if Code == "+CIEV" and len(Values) == 2 and Values[0] == 0:
+        IridiumMetrics.metrics.Signal(Values[1])
+    elif Code in ("+SBDSX", "+SBDIX", "SBDRING"):
+        GetModemState(serialPort).OnReply(Code, Values)
+
+    for callback in list(Subscribers.get(Code, [])):
+        try:
+            callback(serialPort, Code, Values)
+        except Exception:
+            Log("Error in " + Code + " subscriber:")
+            Log(traceback.format_exc())
+
+class Dispatcher(object):
+    """ Background thread that listens to the port between commands and hands unsolicited result codes to subscribers. With OnMessage it
+    answers each ring alert with a mailbox check (AT+SBDIXA) and calls OnMessage(MTMSN, message) for every MT message received, so there's
+    no need to poll the gateway with AT+SBDIX."""
+
+    def __init__(self, serialPort, OnMessage=None, Binary=False):
+        self.serialPort = serialPort
+        self.rxBuffer = GetRxBuffer(serialPort)
+        self.OnMessage = OnMessage
+        self.Binary = Binary
+        self.running = False
+        self.thread = None
+
+    def Start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.Run, name="IridiumDispatcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def Run(self):
+        while self.running:
+            try:
+                fileno = self.serialPort.fileno()
+                select.select([fileno], [], [], 1)                      # Wake when there's data or once a second to check running.
+            except Exception:
+                time.sleep(1)
+
+            with self.rxBuffer.lock:                                    # Waits for any command in flight to finish.
+                self.rxBuffer.Fill(0)
+                self.rxBuffer.Take(self.rxBuffer.lineScan)              # No command running so scanned lines are of no use to anyone.
+
+            self.Deliver()
+
+    def Deliver(self):
+        while self.rxBuffer.unsolicited:
+            code, values = self.rxBuffer.unsolicited.popleft()
+            Log("Unsolicited: %s %s", Args=(code, values))
+
+            Notify(self.serialPort, code, values)
+
+            if code == "SBDRING" and self.OnMessage:
+                Log("Ring alert. Checking mailbox.")
+                for MTmsn, mtMsg in DrainSBD(self.serialPort, self.Binary, Answer=True):
+                    self.OnMessage(MTmsn, mtMsg)
 
 def CheckConnected(serialPort):
     """ Checks if RockBlock is connected. AT\r should receive echo."""
@@ -214,266 +448,886 @@ def CheckConnected(serialPort):
     Log("Iridium All Good!")
     return True
 
+@Exclusive
 def BufferSbdMessage(serialPort, sbdMessage):
     """ This command is used to transfer a text SBD message from the DTE to the single mobile originated buffer
     in the 9602. If any data is currently in the mobile originated buffer, it will be overwritten. """
 
-    Log("BufferSbdMessage(" + sbdMessage + ")")
+    Log("BufferSbdMessage(%s)", Args=(sbdMessage,))
 
     if not WriteAndCheck(serialPort, "AT+SBDWT\r", "READY", 60):                        # the 9602 will indicate to the DTE that it is prepared to receive the message by sending the string READY
         Log("Issue Buffering Message - Modem didn't reply with ready to receive.")
         return False
 
     Log("Modem Ready To Receive Message")
-    time.sleep(3)
 
     if not WriteAndCheck(serialPort, sbdMessage + "\r", "0", 60):                       # Send text to buffer. The text message must be sent, terminated by a carriage return.
         Log("Problem While Buffering Message")
         return False
 
-    time.sleep(2)
     Log("Message Buffered")
+    IridiumMetrics.metrics.Count("moBytes", len(sbdMessage))
+    GetModemState(serialPort).Update(moFlag=1)
+
+    return True
+
+def SbdChecksum(Payload):
+    """ Two byte checksum used by AT+SBDWB and AT+SBDRB, the least significant 16 bits of the summation of the payload bytes."""
+    return sum(bytearray(Payload)) & 0xFFFF
+
+SbdwbCodes = {0: "SBD message successfully written to the 9602.",
+              1: "SBD message write timeout. An insufficient number of bytes were transferred to 9602 during the transfer period of 60 seconds.",
+              2: "SBD message checksum sent from DTE does not match the checksum calculated by the 9602.",
+              3: "SBD message size is not correct. The maximum mobile originated SBD message length is 340 bytes."}
+
+@Exclusive
+def BufferSbdBinary(serialPort, Payload):
+    """ Binary version of BufferSbdMessage using AT+SBDWB. Payload can be any bytes like object of up to MaxMoBytes bytes and is sent as
+    is followed by its two byte checksum. If any data is currently in the mobile originated buffer, it will be overwritten."""
+
+    payload = memoryview(Payload)
+    length = len(payload)
+
+    Log("BufferSbdBinary(%d bytes)", Args=(length,))
+
+    if not 1 <= length <= MaxMoBytes:
+        Log("Binary message must be 1 to " + str(MaxMoBytes) + " bytes.")
+        return False
+
+    if not WriteAndCheck(serialPort, "AT+SBDWB=" + str(length) + "\r", "READY", 60):         # 9602 replies READY when it's prepared to receive the bytes.
+        Log("Issue Buffering Binary Message - Modem didn't reply with ready to receive.")
+        return False
+
+    frame = bytearray(payload)
+    frame += struct.pack(">H", SbdChecksum(frame))
+
+    SerialWrite(serialPort, bytes(frame))
+
+    result = ReadResponse(serialPort, "", "0", 60)                                    # Binary data isn't echoed so there's no echo to skip.
+
+    if result is not None and result.isdigit():
+        ReadResponse(serialPort, "", "OK", 5)                                           # The OK after the result code, so it can't end the next command.
+
+    if result != "0":
+        if result is not None and result.isdigit():
+            Log(SbdwbCodes.get(int(result), "Unknown AT+SBDWB code " + result + "."))
+        Log("Problem While Buffering Binary Message")
+        return False
 
+    Log("Binary Message Buffered")
+    IridiumMetrics.metrics.Count("moBytes", length)
+    GetModemState(serialPort).Update(moFlag=1)
     return True
 
+@Exclusive
+def GetBinary(serialPort):
+    """ Binary version of GetText using AT+SBDRB. Transfers the mobile terminated buffer to the DTE and returns its payload as bytes, or None
+    if the transfer fails or its checksum doesn't match.
+    Response: {2-byte message length} {binary SBD message} {2-byte checksum}"""
+
+    echo = "AT+SBDRB\r"
+
+    Log("GetBinary()")
+
+    SerialWrite(serialPort, echo)
+
+    rxBuffer = GetRxBuffer(serialPort)
+    deadline = time.time() + 60
+
+    if not rxBuffer.Wait(len(echo), deadline):                                          # Even an empty message plus OK is longer than the echo.
+        Log("GetBinary(): Timed out waiting for message.")
+        return None
+
+    if rxBuffer.data.startswith(echo):
+        rxBuffer.Take(len(echo))
+
+    if not rxBuffer.Wait(2, deadline):
+        Log("GetBinary(): Timed out waiting for message length.")
+        return None
+
+    length = struct.unpack(">H", rxBuffer.Take(2))[0]
+
+    if not rxBuffer.Wait(length + 2, deadline):
+        Log("GetBinary(): Timed out waiting for " + str(length) + " byte message.")
+        return None
+
+    payload = rxBuffer.Take(length)
+    checksum = struct.unpack(">H", rxBuffer.Take(2))[0]
+
+    ReadResponse(serialPort, "", "OK", max(0, deadline - time.time()))
+
+    if checksum != SbdChecksum(payload):
+        Log("GetBinary(): Checksum mismatch, message discarded.")
+        return None
+
+    Log("Received %d byte binary message.", Args=(length,))
+    return payload
+
+@Exclusive
 def WriteAndCheck(serialPort, WriteCommand, ExpectedReply, Timeout):
     """ Write a message to RockBlock and wait for expected reply or timeout."""
     try:
-        Log("Sending Command: " + WriteCommand)
+        Log("Sending Command: %s", Args=(WriteCommand,))
+
+        with IridiumMetrics.Timer(IridiumMetrics.CommandName(WriteCommand)) as timer:
+            SerialWrite(serialPort, WriteCommand)                                       # Write command to RockBlock.
+
+            result = ReadResponse(serialPort, WriteCommand, ExpectedReply, Timeouts.Timeout(WriteCommand, Timeout))   # Wait for reply, final result code or timeout.
+            timer.Ok = result == ExpectedReply
+
+        Timeouts.Observe(WriteCommand, timer.Seconds, result is None)
 
-        SerialWrite(serialPort, WriteCommand)                                           # Write command to RockBlock.
+        if result is not None and result not in FinalResultCodes:
+            ReadResponse(serialPort, "", "OK", 5)                                       # Information response or numeric result code, its OK is still to come.
 
-        return CheckForReply(serialPort, ExpectedReply, Timeout)                        # Wait for reply or timeout.
+        if timer.Ok and WriteCommand.startswith("AT"):
+            GetModemState(serialPort).OnCommand(WriteCommand)
+
+        return timer.Ok
 
     except:
-        Log("Unexpected Error:")
-        Log(traceback.format_exc())
+        Log("Unexpected Error:", logging.ERROR)
+        Log(traceback.format_exc(), logging.ERROR)
         return False
 
 def SerialWrite(serialPort, Message):
     """ Write message on serial port."""
 
+    rxBuffer = GetRxBuffer(serialPort)
+    rxBuffer.Fill(0)                                                                    # Pick up any unsolicited result codes before throwing the input away.
     serialPort.flushInput()
+    rxBuffer.Clear()                                                                    # Anything left over from the last reply is stale too.
 
     serialPort.write(Message)
+    IridiumMetrics.metrics.Count("bytesWritten", len(Message))
+
+def Sleep(Seconds):
+    """ time.sleep() that counts towards the sleep time in IridiumMetrics."""
+    IridiumMetrics.metrics.Count("sleepSeconds", Seconds)
+    time.sleep(Seconds)
+
+class TimeoutPolicy(object):
+    """ Per command timeouts learned from observed reply times. Once MinSamples replies to a command have been seen its timeout is the
+    Percentile reply time of the last Window replies times Factor plus Margin seconds, but never more than the fixed timeout the call site
+    gives. After a timeout the command gets its full fixed timeout till it's answered again, in case the modem has just got slower.
+    Commands in Fixed always get their full timeout: the +SBDIX reply is the only word on whether a message went, so giving up on it early
+    leaves the session running and the message is sent again by the retry."""
+
+    def __init__(self, Percentile=99, Factor=1.5, Margin=2, MinSamples=10, Window=100, Fixed=("AT+SBDIX", "AT+SBDIXA")):
+        self.Percentile = Percentile
+        self.Factor = Factor
+        self.Margin = Margin
+        self.MinSamples = MinSamples
+        self.Window = Window
+        self.Fixed = Fixed
+        self.Enabled = True
+        self.samples = {}                                                               # Command name -> recent reply times.
+        self.missed = set()                                                             # Commands whose last try timed out.
+        self.lock = threading.Lock()
+
+    def Timeout(self, Command, Default):
+        """ Seconds to wait for the reply to Command, Default at most."""
+        name = IridiumMetrics.CommandName(Command)
+
+        with self.lock:
+            samples = self.samples.get(name)
+            if not self.Enabled or name in self.Fixed or name in self.missed or samples is None or len(samples) < self.MinSamples:
+                return Default
+            ordered = sorted(samples)
+
+        percentile = ordered[min(len(ordered) - 1, int(len(ordered) * self.Percentile / 100.0))]
+        return min(Default, percentile * self.Factor + self.Margin)
+
+    def Observe(self, Command, Seconds, TimedOut=False):
+        name = IridiumMetrics.CommandName(Command)
+
+        with self.lock:
+            if TimedOut:
+                self.missed.add(name)
+                return
+
+            self.missed.discard(name)
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.Window)
+            samples.append(Seconds)
+
+    def Snapshot(self):
+        """ Current timeout for each command seen, as learned (not capped by any call site's fixed timeout)."""
+        return dict((name, self.Timeout(name, float("inf"))) for name in list(self.samples) if name not in self.Fixed)
+
+Timeouts = TimeoutPolicy()
+
+FinalResultCodes = ("OK", "ERROR", "READY")
+
+def IsFinalResultCode(Line):
+    """ True for lines that end a command response: OK, ERROR, READY or a bare numeric result code."""
+    return Line in FinalResultCodes or Line.isdigit()
+
+def ReadResponse(serialPort, WriteCommand, ExpectedReply, Timeout):
+    """ Reads reply lines till one starting with ExpectedReply or a final result code arrives. Returns ExpectedReply if it was seen, the
+    final result code otherwise, or None on timeout. The echo of WriteCommand is skipped so echoed text can't pass for a result."""
+    echo = WriteCommand.strip()
+    rxBuffer = GetRxBuffer(serialPort)
+    deadline = time.time() + Timeout
+
+    while True:
+        line = rxBuffer.ReadLine(deadline)
+
+        if line is None:
+            Log("Iridium.ReadResponse() - Timed out waiting for " + ExpectedReply)
+            return None
+
+        if line == echo:
+            continue
+
+        if line.startswith(ExpectedReply):
+            return ExpectedReply
+
+        if IsFinalResultCode(line):
+            Log("Iridium.ReadResponse() - Expected " + ExpectedReply + ", got " + line)
+            return line
+
+SbdixReply = namedtuple("SbdixReply", "MOstatus MOmsn MTstatus MTmsn MTlength MTqueued")
+SbdsxReply = namedtuple("SbdsxReply", "MoFlag MoMsn MtFlag MtMsn RaFlag MsgWaiting")
+CsqReply = namedtuple("CsqReply", "Signal")
+SbdrtReply = namedtuple("SbdrtReply", "Text")
+
+ReplyTypes = {"+SBDIX": SbdixReply, "+SBDSX": SbdsxReply, "+CSQ": CsqReply}                 # Information responses of comma separated integers.
+
+def ParseReply(Line):
+    """ Turns an information response line such as "+SBDIX: 0, 12, 0, -1, 0, 0" into its typed record. Returns None for lines of any other
+    kind or that don't parse."""
+    code, colon, values = Line.partition(':')
+    replyType = ReplyTypes.get(code)
+
+    if replyType is None or not colon:
+        return None
 
-    time.sleep(3)
+    try:
+        return replyType._make(int(value) for value in values.split(','))
+    except (ValueError, TypeError):                                                     # TypeError for the wrong number of values.
+        return None
 
-def ShortBurstDataStatus(serialPort):
-    """ This command returns current state of the mobile originated and mobile terminated buffers, and the SBD ring alert status.
-    Response: +SBDSX: <MO flag>, <MOMSN>, <MT flag>, <MTMSN>, <RA flag>, <msg waiting>"""
+def ReadReply(serialPort, WriteCommand, Code, Timeout):
+    """ Reads reply lines till the Code information response ("+SBDIX", "+SBDSX", "+CSQ" or "+SBDRT") arrives and returns it as a typed
+    record, reading on to the final result code so it can't be taken for part of the next reply. The echo of WriteCommand and unsolicited
+    result codes in between are skipped. Returns None on timeout, a final result code first or a reply that doesn't parse.
+    +SBDRT gives an SbdrtReply of the message text lines, joined with CR, that come between it and the OK."""
+    echo = WriteCommand.strip()
+    prefix = Code + ":"
+    rxBuffer = GetRxBuffer(serialPort)
+    deadline = time.time() + Timeout
+    record = None
+    text = None                                                                         # +SBDRT message lines, once +SBDRT: has been read.
+
+    while True:
+        line = rxBuffer.ReadLine(deadline)
+
+        if line is None:
+            if record is None:
+                Log("Iridium.ReadReply() - Timed out waiting for " + Code)
+            return record
+
+        if text is not None:                                                            # Message text can look like anything but OK.
+            if line == "OK":
+                return SbdrtReply("\r".join(text))
+            text.append(line)
+        elif line == echo or line.startswith(UnsolicitedCodes):                         # Unsolicited codes were queued when the line was read.
+            continue
+        elif IsFinalResultCode(line):
+            if record is None:
+                Log("Iridium.ReadReply() - Expected " + Code + ", got " + line)
+            return record
+        elif record is None and line.startswith(prefix):
+            if Code == "+SBDRT":                                                        # Response: +SBDRT:<CR> {mobile terminated buffer}
+                text = []
+                continue
 
-    Log("ShortBurstDataStatus(). Checking buffers. Sending AT+SBDSX Command.")
-    SerialWrite(serialPort, "AT+SBDSX\r")                                                       # Write command to 9602
+            record = ParseReply(line)
+            if record is None:
+                Log("Iridium.ReadReply() - Can't parse " + line)
+                return None
 
-    Log("Waiting for reply...")
-    reply = ReadToEndOfMessage(serialPort, '\r', "+SBDSX:", 90)                                 # Read to EOL of expected response.
+            deadline = min(deadline, time.time() + 5)                                   # The final result code follows straight away.
 
-    if reply is not None:
-        Log("Reply: ")
-        Log(reply)
+@Exclusive
+def WriteAndReceive(serialPort, WriteCommand, Response, EOL, Timeout):
+    """ Sends WriteCommand and returns its reply line containing Response, ended with EOL, or None. Kept for existing callers, Query returns
+    the reply parsed."""
+    try:
+        Log("Sending Command: %s", Args=(WriteCommand,))
 
-        reply = reply.strip()                                                                   # remove whitespace
-        status = reply.split(':')[1]                                                            # Remove +SBDSX: portion of repsonse
-        status = status.split(',')                                                              # Split into different codes
+        with IridiumMetrics.Timer(IridiumMetrics.CommandName(WriteCommand)) as timer:
+            SerialWrite(serialPort, WriteCommand)
 
-        MoFlag = int(status[0])                                                                 # 0 No message in mobile originated buffer. 1 Message in mobile originated buffer.
-        MoMsn = int(status[1])                                                                  # The MOMSN identifies the sequence number that will be used during the next mobile originated SBD session.
-        MtFlag = int(status[2])                                                                 # 0 No message in mobile terminated buffer. 1 Message in mobile terminated buffer.
-        MtMsn = int(status[3])                                                                  # The MTMSN identifies the sequence number that was used in the most recent mobile terminated SBD session. This value will be -1 if there is nothing in the mobile terminated buffer.
-        RaFlag = int(status[4])                                                                 # 0 No SBD ring alert. 1 SBD ring alert has been received and needs to be answered.
-        MsgWaiting = int(status[5])                                                             # how many SBD Mobile Terminated messages are currently queued at the gateway awaiting collection by the ISU
+            reply = ReadToEndOfMessage(serialPort, EOL, Response, Timeouts.Timeout(WriteCommand, Timeout))
+            timer.Ok = reply is not None
 
-        Log("MoFlag: " + str(MoFlag) + ", MtFlag: " + str(MtFlag) + ", RaFlag: " + str(RaFlag) + ", MsgWaiting: " + str(MsgWaiting))
+        Timeouts.Observe(WriteCommand, timer.Seconds, reply is None)
 
-        if MtFlag != 1 and MoFlag != 1:                                                         # Buffers are empty so no further action required.
-            Log("No Message In Mobile Rx or Mobile Tx Buffer.")
-            return
+        if reply is not None:
+            ReadResponse(serialPort, "", "OK", 5)                                       # Read the rest of the response so its OK can't be taken for part of the next one.
 
-        if MtFlag == 1:                                                                         # Dispalys Rx message. No real use apart from debug.
-            Log("Message In Mobile Rx Buffer. Reading buffer...")
+        return reply
 
-            SerialWrite(serialPort, "AT+SBDRT\r")
+    except:
+        Log("Unexpected Error:", logging.ERROR)
+        Log(traceback.format_exc(), logging.ERROR)
 
-            reply = ReadToEndOfMessage(serialPort, '\r', "OK", 60)
+def ReadToEndOfMessage(serialPort, EndChar, ExpectedReply, MaxTimeSec):
+    """ Reads reply lines, skipping command echoes, till one containing ExpectedReply and returns it ended with EndChar. Returns None on
+    timeout or if a final result code comes first. Kept for existing callers, see ReadReply."""
+    rxBuffer = GetRxBuffer(serialPort)
+    deadline = time.time() + MaxTimeSec
 
-            Log("Rx Buffer Message:")
-            Log(reply)
+    while True:
+        line = rxBuffer.ReadLine(deadline)
 
-        if MoFlag == 1:                                                                         # Moves Tx buffer messages to Rx buffer and displays for debug.
-            Log("Message in Tx Buffer. Moving to Rx buffer to read.")
-            SerialWrite(serialPort, "AT+SBDTC\r")
-            reply = ReadToEndOfMessage(serialPort, '\r', "SBDTC:", 60)
-            Log(reply)
-            SerialWrite(serialPort, "AT+SBDRT\r")
-            reply = ReadToEndOfMessage(serialPort, '\r', "OK", 60)
-            Log("Tx Buffer Message:")
-            Log(reply)
-    else:
-        Log("Something wrong waiting for AT+SBDSX reply.")
+        if line is None:
+            Log("Iridium.ReadToEndOfMessage() - Timed out waiting for " + ExpectedReply)
+            return None
 
-def ClearBufferDebug(serialPort):
-    """ This command returns current state of the mobile originated and mobile terminated buffers, and the SBD ring alert status.
-    Response: +SBDSX: <MO flag>, <MOMSN>, <MT flag>, <MTMSN>, <RA flag>, <msg waiting>
-    Will display any messages in buffer for debug and clear all buffers. """
+        if line.upper().startswith("AT"):
+            continue
+
+        if ExpectedReply in line:
+            return line + EndChar
+
+        if IsFinalResultCode(line):
+            Log("Iridium.ReadToEndOfMessage() - Expected " + ExpectedReply + ", got " + line)
+            return None
+
+def CheckForReply(serialPort, ExpectedReply, Timeout):
+    """ Reads reply lines till one starting with ExpectedReply. Returns True if it came, False on timeout or if a different final result code
+    came first. Kept for existing callers, see ReadResponse."""
+    return ReadResponse(serialPort, "", ExpectedReply, Timeout) == ExpectedReply
 
-    Log("Checking buffers. Sending AT+SBDSX Command.")
-    SerialWrite(serialPort, "AT+SBDSX\r")                                                       # Write command to 9602
+@Exclusive
+def Query(serialPort, WriteCommand, Code, Timeout):
+    """ Sends WriteCommand and returns its Code reply as a typed record, or None. See ReadReply."""
+    Log("Sending Command: %s", Args=(WriteCommand,))
 
-    Log("Waiting for reply...")
-    reply = ReadToEndOfMessage(serialPort, '\r', "+SBDSX:", 90)                                 # Read to EOL of expected response.
+    with IridiumMetrics.Timer(IridiumMetrics.CommandName(WriteCommand)) as timer:
+        SerialWrite(serialPort, WriteCommand)
+
+        reply = ReadReply(serialPort, WriteCommand, Code, Timeouts.Timeout(WriteCommand, Timeout))
+        timer.Ok = reply is not None
+
+    Timeouts.Observe(WriteCommand, timer.Seconds, reply is None)
+    return reply
+
+Settings = (("reporting", "+CIER", [1, 1, 1]),                                         # (ModemState field, command, values) applied by Configure.
+            ("ring", "+SBDMTA", [1]),
+            ("autoRegister", "+SBDAREG", [1]))
+
+CommandEffects = {"+SBDD0": {"moFlag": 0},                                              # What a command that succeeds does to ModemState.
+                  "+SBDD1": {"mtFlag": 0},
+                  "+SBDD2": {"moFlag": 0, "mtFlag": 0}}
+for field, command, values in Settings:
+    CommandEffects[command + "=" + ",".join(str(value) for value in values)] = {field: True}
+
+def Configure(serialPort):
+    """ Runs the StartReporting, EnableRing and StartAutoRegister settings as a single chained command line so the startup sequence is one
+    round trip. Falls back to sending them one at a time if the modem rejects the chained line.
+    When the ModemState says they've been applied before, e.g. on reconnecting with a state file from the last run, they're read back with
+    one chained query instead and only any the modem has lost are sent."""
+    Log("Configure()")
+
+    settings = Settings
+
+    if GetModemState(serialPort).Configured():
+        applied = ReadSettings(serialPort)
+        if applied is not None:
+            settings = [setting for setting in Settings if not applied.get(setting[0])]
+            if not settings:
+                Log("Configuration already applied.")
+                return True
+            Log("Reapplying " + ", ".join(setting[1] for setting in settings))
+
+    if WriteAndCheck(serialPort, "AT" + ";".join(command + "=" + ",".join(str(value) for value in values) for field, command, values in settings) + "\r", "OK", 40):
+        Log("Configured.")
+        return True
+
+    Log("Chained configuration rejected. Sending commands individually.")
+
+    return StartReporting(serialPort) and EnableRing(serialPort) and StartAutoRegister(serialPort)
+
+@Exclusive
+def ReadSettings(serialPort):
+    """ Reads the Settings back with one chained query, returning {ModemState field: True if applied}, or None if the query fails."""
+    query = "AT" + ";".join(command + "?" for field, command, values in Settings) + "\r"
+    echo = query.strip()
+    rxBuffer = GetRxBuffer(serialPort)
 
-    if reply is not None:
-        Log("Reply: ")
-        Log(reply)
+    Log("Sending Command: %s", Args=(query,))
+    SerialWrite(serialPort, query)
 
-        reply = reply.strip()                                                                   # remove whitespace
-        status = reply.split(':')[1]                                                            # Remove +SBDSX: portion of repsonse
-        status = status.split(',')                                                              # Split into different codes
+    deadline = time.time() + Timeouts.Timeout(query, 20)
+    replies = {}
 
-        MoFlag = int(status[0])                                                                 # 0 No message in mobile originated buffer. 1 Message in mobile originated buffer.
-        MoMsn = int(status[1])                                                                  # The MOMSN identifies the sequence number that will be used during the next mobile originated SBD session.
-        MtFlag = int(status[2])                                                                 # 0 No message in mobile terminated buffer. 1 Message in mobile terminated buffer.
-        MtMsn = int(status[3])                                                                  # The MTMSN identifies the sequence number that was used in the most recent mobile terminated SBD session. This value will be -1 if there is nothing in the mobile terminated buffer.
-        RaFlag = int(status[4])                                                                 # 0 No SBD ring alert. 1 SBD ring alert has been received and needs to be answered.
-        MsgWaiting = int(status[5])                                                             # how many SBD Mobile Terminated messages are currently queued at the gateway awaiting collection by the ISU
+    while True:
+        line = rxBuffer.ReadLine(deadline)
 
-        Log("MoFlag: " + str(MoFlag) + ", MtFlag: " + str(MtFlag) + ", RaFlag: " + str(RaFlag) + ", MsgWaiting: " + str(MsgWaiting))
+        if line is None or line == "ERROR":
+            Log("ReadSettings(): No valid reply.")
+            return None
 
-        if MtFlag != 1 and MoFlag != 1:                                                         # Buffers are empty so no further action required.
-            Log("No Message In Mobile Rx or Mobile Tx Buffer.")
+        if line == "OK":
+            break
+
+        if line != echo and not line.startswith(UnsolicitedCodes):
+            code, values = ParseUnsolicited(line)
+            replies[code] = values
+
+    applied = dict((field, replies.get(command, [])[:len(values)] == values) for field, command, values in Settings)
+    GetModemState(serialPort).Update(**applied)
+    return applied
+
+class ModemState(object):
+    """ Mirror of what's known about a modem: whether each of the Settings is applied, the SBD buffer flags and sequence numbers of an
+    +SBDSX reply and the time it was last updated. It's kept up to date from the commands that succeed and the +SBDSX, +SBDIX and SBDRING
+    replies seen, and saved to the state file if SetStateFile() has been called. Anything not known is None."""
+
+    SbdFields = ("moFlag", "moMsn", "mtFlag", "mtMsn", "raFlag", "msgWaiting")                # In +SBDSX order.
+    Fields = ("reporting", "ring", "autoRegister") + SbdFields
+
+    def __init__(self, Name=None, **values):
+        self.Name = Name
+        for field in self.Fields:
+            setattr(self, field, values.get(field))
+        self.updated = values.get("updated", 0)
+
+    def Update(self, **values):
+        changed = False
+
+        with StateLock:
+            for field, value in values.items():
+                if getattr(self, field) != value:
+                    setattr(self, field, value)
+                    changed = True
+            self.updated = time.time()
+
+        if changed:
+            SaveState()
+
+    def Configured(self):
+        return all(getattr(self, field) for field, command, values in Settings)
+
+    def SbdStatus(self):
+        """ The buffer state as an SbdsxReply, or None if any of it isn't known."""
+        status = SbdsxReply._make(getattr(self, field) for field in self.SbdFields)
+        return None if None in status else status
+
+    def AsDict(self):
+        values = dict((field, getattr(self, field)) for field in self.Fields)
+        values["updated"] = self.updated
+        return values
+
+    def OnCommand(self, Command):
+        """ Applies the CommandEffects of each command on a command line that succeeded."""
+        for command in Command.strip()[2:].split(";"):
+            effects = CommandEffects.get(command.strip().upper())
+            if effects:
+                self.Update(**effects)
+
+    def OnReply(self, Code, Values):
+        if Code == "+SBDSX":
+            self.Update(**dict(zip(self.SbdFields, Values)))
+        elif Code == "SBDRING":
+            self.Update(raFlag=1)
+        elif Code == "+SBDIX":
+            reply = SbdixReply._make(Values)
+            values = {}
+            if reply.MOstatus <= 8 and self.moFlag != 0:                                # A buffered message was sent, the next one gets the next MOMSN.
+                values["moMsn"] = None if self.moFlag is None else (reply.MOmsn + 1) & 0xFFFF
+            if reply.MTstatus == 1:
+                values.update(mtFlag=1, mtMsn=reply.MTmsn)
+            if reply.MTstatus != 2:
+                values.update(raFlag=0, msgWaiting=reply.MTqueued)                      # A mailbox check answers the ring alert.
+            self.Update(**values)
+
+ModemStates = {}
+StateLock = threading.RLock()
+StateFile = None
+SaveDelay = 1                                                           # Seconds SaveState() waits before writing the state file.
+SaveTimer = None
+WriteLock = threading.Lock()                                            # One write of the state file at a time.
+
+def GetModemState(serialPort):
+    """ Returns the ModemState for serialPort, creating it on first use from the state file's copy for the port's name if there is one."""
+    with StateLock:
+        state = ModemStates.get(serialPort)
+
+        if state is None:
+            name = getattr(serialPort, "port", None)
+            state = ModemStates[serialPort] = ModemState(name, **LoadState().get(name, {}))
+
+        return state
+
+def SetStateFile(Path):
+    """ Keeps a copy of every port's ModemState in the JSON file at Path, so the next run can skip configuration that's already applied.
+    Set it before the ports are first used."""
+    global StateFile
+    StateFile = Path
+
+def LoadState():
+    if not StateFile or not os.path.exists(StateFile):
+        return {}
+
+    try:
+        with open(StateFile) as stateFile:
+            return json.load(stateFile)
+    except (IOError, OSError, ValueError):
+        Log("LoadState(): Can't read " + StateFile, logging.WARNING)
+        return {}
+
+def SaveState():
+    """ Schedules a write of the state file SaveDelay seconds from now, off the serial path, so a burst of updates is written once."""
+    global SaveTimer
+    if not StateFile:
+        return
+
+    with StateLock:
+        if SaveTimer is None:
+            SaveTimer = threading.Timer(SaveDelay, WriteState)
+            SaveTimer.daemon = True
+            SaveTimer.start()
+
+def WriteState():
+    """ Writes the state file if a write is scheduled, via a synced temporary file so a crash or power cut can't leave it half written.
+    Registered to run at exit so a scheduled write isn't lost."""
+    global SaveTimer
+
+    with StateLock:
+        if SaveTimer is None:
+            return
+        SaveTimer.cancel()
+        SaveTimer = None
+        if not StateFile:
             return
+        path = StateFile
+        snapshot = [(state.Name, state.AsDict()) for state in ModemStates.values() if state.Name]
 
-        if MtFlag == 1:                                                                         # Dispalys Rx message. No real use apart from debug.
-            Log("Message In Mobile Rx Buffer. Reading buffer...")
+    with WriteLock:
+        states = LoadState()
+        states.update(snapshot)
 
-            SerialWrite(serialPort, "AT+SBDRT\r")
+        try:
+            with open(path + ".tmp", "w") as stateFile:
+                json.dump(states, stateFile)
+                stateFile.flush()
+                os.fsync(stateFile.fileno())
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError):
+            Log("WriteState(): Can't write " + path, logging.WARNING)
+
+atexit.register(WriteState)
+
+def GetSbdStatus(serialPort, MaxAge=None):
+    """ Sends AT+SBDSX and returns its six values as an SbdsxReply, or None if there's no valid reply. With MaxAge the ModemState's copy is
+    returned instead, without asking the modem, if it's complete and was updated in the last MaxAge seconds.
+    Response: +SBDSX: <MO flag>, <MOMSN>, <MT flag>, <MTMSN>, <RA flag>, <msg waiting>"""
 
-            reply = ReadToEndOfMessage(serialPort, '\r', "OK", 60)
+    if MaxAge is not None:
+        state = GetModemState(serialPort)
+        status = state.SbdStatus()
+        if status is not None and time.time() - state.updated <= MaxAge:
+            return status
 
-            Log("Rx Buffer Message:")
-            Log(reply)
+    status = Query(serialPort, "AT+SBDSX\r", "+SBDSX", 90)
 
-        if MoFlag == 1:                                                                         # Moves Tx buffer messages to Rx buffer and displays for debug.
-            Log("Message in Tx Buffer. Moving to Rx buffer to read before clearing.")
-            SerialWrite(serialPort, "AT+SBDTC\r")
-            reply = ReadToEndOfMessage(serialPort, '\r', "SBDTC:", 60)
-            Log(reply)
-            SerialWrite(serialPort, "AT+SBDRT\r")
-            reply = ReadToEndOfMessage(serialPort, '\r', "OK", 60)
-            Log("Tx Buffer Message:")
-            Log(reply)
+    if status is None:
+        Log("GetSbdStatus(): No reply.")
+        return None
 
-        Log("Clearing buffers...")                                                            # Sending a message from the 9602 to the ESS does not clear the mobile originated buffer. Reading a message from the 9602 does not clear the mobile terminated buffer.
-        if not WriteAndCheck(serialPort, "AT+SBDD2\r", "0", 20):
-            Log("Clearing failed.")
-        Log("Buffers cleared.")
-    else:
+    Notify(serialPort, "+SBDSX", status)
+    return status
+
+@Exclusive
+def ShortBurstDataStatus(serialPort, MaxAge=None):
+    """ This command returns current state of the mobile originated and mobile terminated buffers, and the SBD ring alert status. MaxAge
+    is as for GetSbdStatus.
+    Response: +SBDSX: <MO flag>, <MOMSN>, <MT flag>, <MTMSN>, <RA flag>, <msg waiting>"""
+
+    Log("ShortBurstDataStatus(). Checking buffers.")
+    status = GetSbdStatus(serialPort, MaxAge)
+
+    if status is None:
         Log("Something wrong waiting for AT+SBDSX reply.")
+        return
 
-def ProcessMoStatus(MoStatus):
-    """ Handles MoStatus options."""
+    LogBuffers(serialPort, status)
 
-    if MoStatus == 0:
-        Log("MO message, if any, transferred successfully.")
-        return True
-    elif MoStatus == 1:
-        Log("MO message, if any, transferred successfully, but the MT message in the queue was too big to be transferred.")
-        return True
-    elif MoStatus == 2:
-        Log("MO message, if any, transferred successfully, but the requested Location Update was not accepted.")
-        return True
-    elif  3 <= MoStatus <= 8:
-        Log("Reserved, but indicate MO session success if used.")
-        return True
-    elif MoStatus == 10:
-        Log("Gateway reported that the call did not complete in the allowed time.")
-    elif MoStatus == 11:
-        Log("MO message queue at the Gateway is full.")
-    elif MoStatus == 12:
-        Log("MO message has too many segments.")
-    elif MoStatus == 13:
-        Log("Gateway reported that the session did not complete.")
-    elif MoStatus == 14:
-        Log("Invalid segment size.")
-    elif MoStatus == 15:
-        Log("Access is denied.")
-    elif MoStatus == 16:
-        Log("Transceiver has been locked and may not make SBD calls (see +CULK command).")
-    elif MoStatus == 17:
-        Log("Gateway not responding (local session timeout).")
-    elif MoStatus == 18:
-        Log("Connection lost (RF drop).")
-    elif 19 <= MoStatus <= 31:
-        Log("Reserved, but indicate MO session failure if used.")
-    elif MoStatus == 32:
-        Log("No network service, unable to initiate call.")
-    elif MoStatus == 33:
-        Log("Antenna fault, unable to initiate call.")
-    elif MoStatus == 34:
-        Log("Radio is disabled, unable to initiate call (see *Rn command).")
-    elif MoStatus == 35:
-        Log("Transceiver is busy, unable to initiate call (typically performing auto-registration).")
-    elif MoStatus == 36:
-        Log("Reserved, but indicate failure if used.")
-    else:
-        Log("Unknown code. Assume error.")
+@Exclusive
+def ClearBufferDebug(serialPort, MaxAge=None):
+    """ This command returns current state of the mobile originated and mobile terminated buffers, and the SBD ring alert status.
+    Response: +SBDSX: <MO flag>, <MOMSN>, <MT flag>, <MTMSN>, <RA flag>, <msg waiting>
+    Will display any messages in buffer for debug and clear all buffers. With MaxAge (see GetSbdStatus) buffers the ModemState knows to be
+    empty cost no round trips at all."""
 
-    return False
+    Log("Checking buffers.")
+    status = GetSbdStatus(serialPort, MaxAge)
+
+    if status is None:
+        Log("Something wrong waiting for AT+SBDSX reply.")
+        return
+
+    if not LogBuffers(serialPort, status):
+        return
+
+    Log("Clearing buffers...")                                                                # Sending a message from the 9602 to the ESS does not clear the mobile originated buffer. Reading a message from the 9602 does not clear the mobile terminated buffer.
+    if not WriteAndCheck(serialPort, "AT+SBDD2\r", "0", 20):
+        Log("Clearing failed.")
+    Log("Buffers cleared.")
 
-def InitiateSBD(serialPort):
+def LogBuffers(serialPort, status):
+    """ Logs the messages in the buffers flagged in status, an SbdsxReply, for debug. Returns False if both buffers are empty.
+    MoFlag, MtFlag: 0 No message in the buffer. 1 Message in the buffer.
+    MoMsn: The sequence number that will be used during the next mobile originated SBD session.
+    MtMsn: The sequence number used in the most recent mobile terminated SBD session, -1 if there is nothing in the mobile terminated buffer.
+    RaFlag: 0 No SBD ring alert. 1 SBD ring alert has been received and needs to be answered.
+    MsgWaiting: How many SBD Mobile Terminated messages are currently queued at the gateway awaiting collection by the ISU."""
+
+    Log("MoFlag: %s, MtFlag: %s, RaFlag: %s, MsgWaiting: %s", Args=(status.MoFlag, status.MtFlag, status.RaFlag, status.MsgWaiting))
+
+    if status.MtFlag != 1 and status.MoFlag != 1:                                               # Buffers are empty so no further action required.
+        Log("No Message In Mobile Rx or Mobile Tx Buffer.")
+        return False
+
+    if status.MtFlag == 1:                                                                      # Dispalys Rx message. No real use apart from debug.
+        Log("Message In Mobile Rx Buffer. Reading buffer...")
+        reply = Query(serialPort, "AT+SBDRT\r", "+SBDRT", 60)
+        Log("Rx Buffer Message:")
+        Log(str(reply.Text if reply else None))
+
+    if status.MoFlag == 1:                                                                      # Moves Tx buffer messages to Rx buffer and displays for debug.
+        Log("Message in Tx Buffer. Moving to Rx buffer to read.")
+        if WriteAndCheck(serialPort, "AT+SBDTC\r", "SBDTC:", 60):
+            reply = Query(serialPort, "AT+SBDRT\r", "+SBDRT", 60)
+            Log("Tx Buffer Message:")
+            Log(str(reply.Text if reply else None))
+
+    return True
+
+MoStatusCodes = {0: (True, "MO message, if any, transferred successfully."),                          # MO status -> (session succeeded, description)
+                 1: (True, "MO message, if any, transferred successfully, but the MT message in the queue was too big to be transferred."),
+                 2: (True, "MO message, if any, transferred successfully, but the requested Location Update was not accepted."),
+                 10: (False, "Gateway reported that the call did not complete in the allowed time."),
+                 11: (False, "MO message queue at the Gateway is full."),
+                 12: (False, "MO message has too many segments."),
+                 13: (False, "Gateway reported that the session did not complete."),
+                 14: (False, "Invalid segment size."),
+                 15: (False, "Access is denied."),
+                 16: (False, "Transceiver has been locked and may not make SBD calls (see +CULK command)."),
+                 17: (False, "Gateway not responding (local session timeout)."),
+                 18: (False, "Connection lost (RF drop)."),
+                 32: (False, "No network service, unable to initiate call."),
+                 33: (False, "Antenna fault, unable to initiate call."),
+                 34: (False, "Radio is disabled, unable to initiate call (see *Rn command)."),
+                 35: (False, "Transceiver is busy, unable to initiate call (typically performing auto-registration)."),
+                 36: (False, "Reserved, but indicate failure if used.")}
+MoStatusCodes.update((code, (True, "Reserved, but indicate MO session success if used.")) for code in range(3, 9))
+MoStatusCodes.update((code, (False, "Reserved, but indicate MO session failure if used.")) for code in range(19, 32))
+
+MtStatusCodes = {0: (True, "No MT SBD message to receive from the Gateway."),                         # MT status -> (mailbox check succeeded, description)
+                 1: (True, "MT SBD message successfully received from the Gateway."),
+                 2: (False, "Possible error during message retrieval. Trying again.")}
+
+def ProcessMoStatus(MoStatus):
+    """ Logs what MoStatus means and returns True if it's a successful session."""
+    isOk, description = MoStatusCodes.get(MoStatus, (False, "Unknown code. Assume error."))
+    Log(description)
+    return isOk
+
+class RetryBudget(object):
+    """ Bounds the sessions DrainSBD runs for one send to MaxAttempts failed sessions and MaxSeconds in all, either None for no limit.
+    The wait after a failed session starts at BaseDelay seconds and doubles after each further failure up to MaxDelay. A session is only
+    started again if its full SessionTimeout fits in what's left of MaxSeconds. Only failed sessions are bounded, the sessions draining a
+    backlog of MT messages after a good one always run."""
+
+    def __init__(self, MaxAttempts=None, MaxSeconds=600, BaseDelay=5, MaxDelay=60):
+        self.MaxAttempts = MaxAttempts
+        self.MaxSeconds = MaxSeconds
+        self.BaseDelay = BaseDelay
+        self.MaxDelay = MaxDelay
+        self.Start()
+
+    def Start(self):
+        self.started = time.time()
+        self.failures = 0
+
+    def Remaining(self):
+        """ Seconds left, or None without a time limit."""
+        if self.MaxSeconds is None:
+            return None
+
+        return max(0, self.started + self.MaxSeconds - time.time())
+
+    def Spare(self):
+        """ Seconds the next session can be put off for and still have its full SessionTimeout in the budget, or None without a time limit."""
+        remaining = self.Remaining()
+        return None if remaining is None else remaining - SessionTimeout
+
+    def Allows(self, Delay=0):
+        """ True if a session started Delay seconds from now fits in the budget."""
+        spare = self.Spare()
+        return spare is None or spare >= Delay
+
+    def Failed(self):
+        """ Counts a failed session. Returns the seconds to wait before the next one, or None if the budget doesn't allow another."""
+        self.failures += 1
+
+        if self.MaxAttempts is not None and self.failures >= self.MaxAttempts:
+            return None
+
+        delay = min(self.MaxDelay, self.BaseDelay * 2 ** (self.failures - 1))
+
+        if not self.Allows(delay):
+            return None
+
+        return delay
+
+    def Report(self, serialPort):
+        """ Logs that the budget is exhausted and notifies "EXHAUSTED" subscribers with [failed sessions, seconds taken]."""
+        seconds = time.time() - self.started
+        Log("Giving up after " + str(self.failures) + " failed sessions in " + str(int(seconds)) + "s.", logging.WARNING)
+        IridiumMetrics.metrics.Count("budgetsExhausted")
+        Notify(serialPort, "EXHAUSTED", [self.failures, seconds])
+
+class SessionResult(list):
+    """ What the sessions run for one InitiateSBD came to: the list of MT messages received, with Replies, the SbdixReply of each
+    session in turn, and Delivered, the reply of the session that sent the MO buffer or None if none did, e.g. as the budget ran out."""
+
+    def __init__(self, Messages=()):
+        list.__init__(self, Messages)
+        self.Replies = []
+
+    @property
+    def Delivered(self):
+        for reply in self.Replies:
+            if MoStatusCodes.get(reply.MOstatus, (False, ""))[0]:
+                return reply
+
+        return None
+
+def InitiateSBD(serialPort, Binary=False, Scheduler=None, MaxAttempts=None, Budget=None):
     """ This command initiates an SBD session between the 9602 and the GSS. If there is a message in the mobile originated buffer it will be transferred to the GSS.
      Similarly if there is one or more MT messages queued at the GSS the oldest will be transferred to the 9602 and placed into the mobile terminated buffer. Buffers are then read and
-     received messages handled appropriately. All queued messages will be read and handled.
+     received messages handled appropriately. All queued messages will be read and handled. With Binary the messages are read with GetBinary
+     rather than GetText. A Scheduler (see IridiumScheduler) decides when to retry a failed session and MaxAttempts limits how many failed
+     sessions are tried before giving up, as does Budget (a RetryBudget), which by default also gives up after 10 minutes. Returns a
+     SessionResult, the list of received messages that also tells whether the MO message was delivered.
      Response: +SBDIX:<MO status>,<MOMSN>,<MT status>,<MTMSN>,<MT length>,<MT queued>"""
-    mtMsgList = []
+    result = SessionResult()
+
+    with IridiumMetrics.Timer("InitiateSBD") as timer:
+        result.extend(mtMsg for MTmsn, mtMsg in DrainSBD(serialPort, Binary, Scheduler=Scheduler, MaxAttempts=MaxAttempts, Budget=Budget, Result=result))
+        timer.Ok = result.Delivered is not None
+
+    return result
+
+SeenMtMsns = {}
+
+def DrainSBD(serialPort, Binary=False, Answer=False, Scheduler=None, MaxAttempts=None, Budget=None, Result=None):
+    """ Generator version of InitiateSBD. Yields (MTMSN, message) for each MT message as soon as it has been read from the buffer rather than
+    once the whole gateway queue is drained. Messages with an MTMSN already seen on this port are skipped and there's no pause between
+    sessions while more messages are queued at the gateway. Answer starts the first session with AT+SBDIXA, the reply to a ring alert.
+    Failed sessions are retried after the Budget's backoff, and then once Scheduler.WaitForWindow() says the link is good enough if a
+    Scheduler is given, till the Budget (a RetryBudget, by default one allowing MaxAttempts failed sessions) is exhausted. A session whose
+    reply is lost while a message is buffered is checked with LostSessionReply() first, so a message that went isn't sent twice. Each
+    session's reply is added to the Replies of Result, a SessionResult, if one is given."""
+    seen = SeenMtMsns.setdefault(serialPort, deque(maxlen=64))
+    budget = Budget or RetryBudget(MaxAttempts)
+    budget.Start()
     isMoOk = False
     isMtOk = False
     MTqueued = 0
 
+    command = "AT+SBDIXA\r" if Answer else "AT+SBDIX\r"
+
     while isMoOk == False or isMtOk == False or MTqueued > 0:
+        state = GetModemState(serialPort)
+        moMsn = state.moMsn if state.moFlag else None                                                   # MOMSN a buffered message goes with, if known.
+        mtMsn = state.mtMsn
 
-        reply = WriteAndReceive(serialPort, "AT+SBDIX\r", "+SBDIX:", '\r', 60)                          # Send initiate command.
+        reply = Query(serialPort, command, "+SBDIX", SessionTimeout)                                   # Send initiate command.
+        command = "AT+SBDIX\r"
 
-        if reply is not None:
+        if reply is None:
+            Log("No reply received.", logging.WARNING, RateLimit=True)
+            if moMsn is not None:
+                reply = LostSessionReply(serialPort, moMsn, mtMsn)                                      # The message may have gone anyway.
 
-            reply = reply.strip()                                                                       # remove whitespace
-            reply = reply.split(':')[1]                                                                 # Remove +SBDIX: portion of repsonse
-            reply = reply.split(',')                                                                    # Split into different codes
+        if reply is not None:
+            MOstatus, MOmsn, MTstatus, MTmsn, MTlength, MTqueued = reply                                # MT queued is a count of mobile terminated SBD messages waiting at the GSS to be transferred to the 9602.
 
-            MOstatus = int(reply[0])                                                                    # MO session status provides an indication of the disposition of the mobile originated transaction. Processed above.
-            MTstatus = int(reply[2])                                                                    # 0 No MT SBD message to receive from the Gateway. 1 MT SBD message successfully received from the Gateway. 2 An error occurred while attempting to perform a mailbox check or receive a message from the Gateway.
-            MTqueued = int(reply[5])                                                                    # MT queued is a count of mobile terminated SBD messages waiting at the GSS to be transferred to the 9602.
+            Notify(serialPort, "+SBDIX", reply)
+            IridiumMetrics.metrics.Session(MOstatus, MTstatus)
+            if Result is not None:
+                Result.Replies.append(reply)
 
-            Log("MO Status: " + str(MOstatus) + ", MT Status: " + str(MTstatus) + ", MT Queued: " + str(MTqueued))
+            Log("MO Status: %s, MT Status: %s, MTMSN: %s, MT Queued: %s", Args=(MOstatus, MTstatus, MTmsn, MTqueued))
 
             isMoOk = ProcessMoStatus(MOstatus)                                                          # Processes code.
 
-            if MTstatus == 0:                                                                           # There wasn't any messages received.
-                Log("No MT SBD message to receive from the Gateway.")
-                isMtOk = True
-            elif MTstatus == 1:                                                                         # Message was received.
-                Log("MT SBD message successfully received from the Gateway.")
-                mtMsg = GetText(serialPort)                                                             # Pull message from buffer.
+            if isMoOk and GetModemState(serialPort).moFlag != 0:                                        # Sending doesn't clear the MO buffer. Clear it before anything else so
+                if not WriteAndCheck(serialPort, "AT+SBDD0\r", "0", 20):                               # no later session, retry or ring alert answer, sends the message again.
+                    Log("Issue clearing MO buffer.", logging.WARNING)
 
-                if mtMsg:
-                    mtMsgList.append(mtMsg)                                                             # Add all messages to a list to be processed at end.
-
-                isMtOk = True
+            isMtOk, description = MtStatusCodes.get(MTstatus, (False, "Unknown MT status " + str(MTstatus) + "."))
+            if isMtOk:
+                Log(description)
             else:
-                Log("Possible error during message retrieval. Trying again.")
-                isMtOk = False                                                                          # Error receiving. Flagged to try again.
+                Log(description, logging.WARNING, RateLimit=True)                                      # Error receiving. Flagged to try again.
 
-            if MTqueued > 0:                                                                            # Keep retrieving messages till all received.
-                Log("More messages queued to receive.....")
+            if MTstatus == 1:                                                                           # Message was received.
+                mtMsg = GetBinary(serialPort) if Binary else GetText(serialPort)                        # Pull message from buffer.
 
-            time.sleep(5)
-        else:
-            Log("No reply received.")
-            time.sleep(3)
+                if MTmsn in seen:
+                    Log("Already received MTMSN " + str(MTmsn) + ". Skipping duplicate.")
+                elif mtMsg:
+                    seen.append(MTmsn)
+                    IridiumMetrics.metrics.Count("mtBytes", len(mtMsg))
+                    yield MTmsn, mtMsg                                                                  # Hand message straight to the caller.
 
-    return mtMsgList                                                                                    # Return the list of received messages.
+            if isMoOk and isMtOk:
+                if MTqueued > 0:                                                                        # Keep retrieving messages till all received, no need to wait.
+                    Log("More messages queued to receive.....")                                 # The budget only bounds failures, a healthy drain runs to the end.
+                continue
 
+        delay = budget.Failed()
+
+        if delay is None:
+            budget.Report(serialPort)
+            return
+
+        IridiumMetrics.metrics.Count("retries")
+        Sleep(delay)                                                                                    # Give the session a moment before trying again.
+
+        if Scheduler:
+            spare = budget.Spare()
+            with IridiumMetrics.Timer("WaitForWindow"):
+                windowed = Scheduler.WaitForWindow(None if spare is None else max(0, spare))            # Then wait till the link looks good enough.
+            if not windowed:
+                budget.Report(serialPort)
+                return
+
+def LostSessionReply(serialPort, MoMsn, MtMsn):
+    """ Stands in for an AT+SBDIX reply that never came. If AT+SBDSX shows the MOMSN has moved on from MoMsn, the one the buffered message
+    was to go with, the session sent it, and an SbdixReply saying so is returned so it isn't sent again. An MT message in the buffer with an
+    MTMSN other than MtMsn, the last one before the session, came in with it. Returns None if the message wasn't sent or that can't be told.
+    AT+SBDSX is asked twice if need be, as the late +SBDIX reply and its OK can still be arriving."""
+    status = GetSbdStatus(serialPort) or GetSbdStatus(serialPort)
+
+    if status is None or status.MoMsn == MoMsn:
+        return None
+
+    Log("MOMSN moved on from %s to %s, the message went in the session whose reply was lost.", logging.WARNING, Args=(MoMsn, status.MoMsn))
+    mtReceived = status.MtFlag == 1 and status.MtMsn != MtMsn
+    return SbdixReply(0, MoMsn, 1 if mtReceived else 0, status.MtMsn if mtReceived else 0, 0, status.MsgWaiting)
+
+@Exclusive
 def GetText(serialPort):
     """ This command is used to transfer a text SBD message from the single mobile terminated buffer in the 9602 to the DTE.
     Response: +SBDRT:<CR> {mobile terminated buffer}
@@ -482,14 +1336,10 @@ def GetText(serialPort):
     05/11/14, 14:39. Test message sent while offline.
     OK
     """
-    SerialWrite(serialPort, "AT+SBDRT\r")
-
-    reply = ReadToEndOfMessage(serialPort, '\r', "OK", 60)
+    reply = Query(serialPort, "AT+SBDRT\r", "+SBDRT", 60)
 
     if reply is None:
         Log("GetText(): Issue getting message")
+        return None
 
-    reply = reply.strip("OK\r")
-    reply = reply.split('+SBDRT:\r')[1]
-
-    return reply
+    return reply.Text
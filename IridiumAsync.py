@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+""" Asyncio versions of the RockBLOCK Iridium functions (Python 3). The port is read from the event loop with add_reader() so waiting for a
+reply costs nothing and other coroutines keep running, and every timeout is an asyncio timeout that can be cancelled.
+
+    modem = await AsyncModem.Open("/dev/ttyUSB0", 19200)
+    if await modem.CheckConnected() and await modem.WaitForSigStr(2, 60):
+        await modem.BufferSbdMessage("Hello")
+        for mtMsg in await modem.InitiateSBD():
+            ..."""
+import asyncio, struct
+from collections import deque
+import Iridium, IridiumMetrics
+
+class AsyncModem(object):
+    """ Owns a serial port on the event loop it's created in, so create it from a coroutine, e.g. with Open(). Commands from different
+    coroutines are run one at a time."""
+
+    def __init__(self, serialPort):
+        self.serialPort = serialPort
+        self.loop = asyncio.get_running_loop()                          # The Event and Lock below belong to it too.
+        self.data = bytearray()
+        self.lineScan = 0
+        self.changed = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.seenMtMsns = deque(maxlen=64)
+        self.signal = None                                              # Latest +CIEV signal strength.
+        self.service = None
+
+        serialPort.timeout = 0                                          # Reads return at once with whatever is waiting.
+        self.loop.add_reader(serialPort.fileno(), self.OnReadable)
+
+    @classmethod
+    async def Open(cls, Port, Baud):
+        """ Opens Port and returns an AsyncModem on the running loop."""
+        return cls(Iridium.OpenSerial(Port, Baud))
+
+    def Close(self):
+        self.loop.remove_reader(self.serialPort.fileno())
+        self.serialPort.close()
+
+    def OnReadable(self):
+        chunk = self.serialPort.read(self.serialPort.in_waiting or 1)
+        if chunk:
+            self.data.extend(chunk)
+            self.ScanUnsolicited()
+            self.changed.set()
+
+    def ScanUnsolicited(self):
+        """ Passes unsolicited result codes in newly completed lines to Iridium subscribers."""
+        while True:
+            end = self.data.find(b"\r", self.lineScan)
+            if end < 0:
+                return
+
+            line = self.data[self.lineScan:end].decode("latin-1").strip()
+            self.lineScan = end + 1
+
+            if line.startswith(Iridium.UnsolicitedCodes):
+                code, values = Iridium.ParseUnsolicited(line)
+                if code == "+CIEV" and len(values) == 2:
+                    if values[0] == 0:
+                        self.signal = values[1]
+                    else:
+                        self.service = values[1]
+                Iridium.Log("Unsolicited: %s %s", Args=(code, values))
+                Iridium.Notify(self.serialPort, code, values)
+
+    async def WaitForData(self):
+        self.changed.clear()
+        await self.changed.wait()
+
+    def Take(self, Length):
+        data = bytes(self.data[:Length])
+        del self.data[:Length]
+        self.lineScan = max(0, self.lineScan - Length)
+        return data
+
+    async def ReadLine(self):
+        """ Next non-empty line without CR/LF."""
+        scanned = 0
+
+        while True:
+            index = self.data.find(b"\r", scanned)
+
+            if index >= 0:
+                line = self.Take(index + 1).strip()
+                if line:
+                    return line.decode("latin-1")
+                scanned = 0
+                continue
+
+            scanned = len(self.data)
+            await self.WaitForData()
+
+    async def ReadExactly(self, Length):
+        while len(self.data) < Length:
+            await self.WaitForData()
+
+        return self.Take(Length)
+
+    def Write(self, Message):
+        """ Throws away stale input, picking up any unsolicited codes in it first, then writes Message."""
+        self.OnReadable()
+        self.serialPort.reset_input_buffer()
+        del self.data[:]
+        self.lineScan = 0
+
+        self.serialPort.write(Message if isinstance(Message, bytes) else Message.encode("latin-1"))
+
+    async def ReadResponse(self, WriteCommand, ExpectedReply):
+        """ As Iridium.ReadResponse: returns the first line starting with ExpectedReply, or the final result code that came instead."""
+        echo = WriteCommand.strip()
+
+        while True:
+            line = await self.ReadLine()
+
+            if line == echo:
+                continue
+
+            if line.startswith(ExpectedReply) or Iridium.IsFinalResultCode(line):
+                return line
+
+    async def Exchange(self, WriteCommand, ExpectedReply, Timeout):
+        """ Writes WriteCommand and returns the reply line, or None on timeout. Caller must hold self.lock."""
+        Iridium.Log("Sending Command: %s", Args=(WriteCommand,))
+        self.Write(WriteCommand)
+
+        reply = None
+
+        with IridiumMetrics.Timer(IridiumMetrics.CommandName(WriteCommand)) as timer:
+            try:
+                reply = await asyncio.wait_for(self.ReadResponse(WriteCommand, ExpectedReply), Iridium.Timeouts.Timeout(WriteCommand, Timeout))
+            except asyncio.TimeoutError:
+                Iridium.Log("AsyncModem - Timed out waiting for " + ExpectedReply)
+                timer.Ok = False
+
+        Iridium.Timeouts.Observe(WriteCommand, timer.Seconds, reply is None)
+
+        if reply is not None and reply not in Iridium.FinalResultCodes and ExpectedReply != "+SBDRT:":     # GetText reads the message up to the OK itself.
+            await self.ReadOk()                                         # Information response or numeric result code, its OK is still to come.
+
+        return reply
+
+    async def ReadOk(self):
+        """ Reads on to the OK ending a reply, so a late OK can't be taken for the result of the next command."""
+        try:
+            await asyncio.wait_for(self.ReadResponse("", "OK"), 5)
+        except asyncio.TimeoutError:
+            Iridium.Log("AsyncModem - No OK after reply.")
+
+    async def WriteAndCheck(self, WriteCommand, ExpectedReply, Timeout):
+        async with self.lock:
+            reply = await self.Exchange(WriteCommand, ExpectedReply, Timeout)
+
+        return reply is not None and reply.startswith(ExpectedReply)
+
+    async def WriteAndReceive(self, WriteCommand, Response, Timeout):
+        """ Returns the reply line starting with Response, or None."""
+        async with self.lock:
+            reply = await self.Exchange(WriteCommand, Response, Timeout)
+
+        return reply if reply is not None and reply.startswith(Response) else None
+
+    async def CheckConnected(self):
+        Iridium.Log("AsyncModem.CheckConnected()")
+        return await self.WriteAndCheck("AT\r", "OK", 20)
+
+    async def StartAutoRegister(self):
+        return await self.WriteAndCheck("AT+SBDAREG=1\r", "OK", 30)
+
+    async def StartReporting(self):
+        return await self.WriteAndCheck("AT+CIER=1,1,1\r", "OK", 40)
+
+    async def EnableRing(self):
+        return await self.WriteAndCheck("AT+SBDMTA=1\r", "OK", 30)
+
+    async def Configure(self):
+        """ As Iridium.Configure."""
+        if await self.WriteAndCheck("AT+CIER=1,1,1;+SBDMTA=1;+SBDAREG=1\r", "OK", 40):
+            return True
+
+        return await self.StartReporting() and await self.EnableRing() and await self.StartAutoRegister()
+
+    async def CheckSignalStrength(self):
+        reply = Iridium.ParseReply(await self.WriteAndReceive("AT+CSQ\r", "+CSQ:", 40) or "")
+
+        if reply is None:
+            return None
+
+        self.signal = reply.Signal
+        Iridium.Log("Strength: %s", Args=(self.signal,))
+        return self.signal
+
+    async def WaitForSigStr(self, MinSigStr, Timeout):
+        """ True once signal strength is above MinSigStr, False on timeout. Uses +CIEV reports when StartReporting is on and only sends
+        AT+CSQ otherwise."""
+        deadline = self.loop.time() + Timeout
+
+        while self.loop.time() < deadline:
+            signalStr = self.signal
+            if signalStr is None or self.service is None:
+                signalStr = await self.CheckSignalStrength()
+
+            if signalStr is not None and signalStr > MinSigStr:
+                return True
+
+            Iridium.Log("Signal Strength Too Weak")
+            try:
+                await asyncio.wait_for(self.WaitForData(), max(0, min(3, deadline - self.loop.time())))
+            except asyncio.TimeoutError:
+                pass
+
+        Iridium.Log("WaitForSigStr() Timed Out.")
+        return False
+
+    async def BufferSbdMessage(self, sbdMessage):
+        Iridium.Log("BufferSbdMessage(%s)", Args=(sbdMessage,))
+
+        async with self.lock:
+            if await self.Exchange("AT+SBDWT\r", "READY", 60) != "READY":
+                Iridium.Log("Issue Buffering Message - Modem didn't reply with ready to receive.")
+                return False
+
+            if await self.Exchange(sbdMessage + "\r", "0", 60) != "0":
+                Iridium.Log("Problem While Buffering Message")
+                return False
+
+        return True
+
+    async def BufferSbdBinary(self, Payload):
+        """ As Iridium.BufferSbdBinary."""
+        payload = memoryview(Payload)
+
+        if not 1 <= len(payload) <= Iridium.MaxMoBytes:
+            Iridium.Log("Binary message must be 1 to " + str(Iridium.MaxMoBytes) + " bytes.")
+            return False
+
+        async with self.lock:
+            if await self.Exchange("AT+SBDWB=" + str(len(payload)) + "\r", "READY", 60) != "READY":
+                Iridium.Log("Issue Buffering Binary Message - Modem didn't reply with ready to receive.")
+                return False
+
+            frame = bytearray(payload)
+            frame += struct.pack(">H", Iridium.SbdChecksum(frame))
+            self.Write(bytes(frame))
+
+            try:
+                result = await asyncio.wait_for(self.ReadResponse("", "0"), 60)
+            except asyncio.TimeoutError:
+                result = None
+
+            if result is not None and result.isdigit():
+                await self.ReadOk()
+
+        if result != "0":
+            if result is not None and result.isdigit():
+                Iridium.Log(Iridium.SbdwbCodes.get(int(result), "Unknown AT+SBDWB code " + result + "."))
+            Iridium.Log("Problem While Buffering Binary Message")
+            return False
+
+        return True
+
+    async def GetText(self):
+        """ As Iridium.GetText, returning just the message text."""
+        async with self.lock:
+            if await self.Exchange("AT+SBDRT\r", "+SBDRT:", 60) != "+SBDRT:":
+                Iridium.Log("GetText(): Issue getting message")
+                return None
+
+            lines = []
+            try:
+                while True:
+                    line = await asyncio.wait_for(self.ReadLine(), 60)
+                    if line == "OK":
+                        break
+                    lines.append(line)
+            except asyncio.TimeoutError:
+                Iridium.Log("GetText(): Timed out reading message")
+                return None
+
+        return "\r".join(lines)
+
+    async def GetBinary(self):
+        """ As Iridium.GetBinary."""
+        echo = b"AT+SBDRB\r"
+
+        async with self.lock:
+            self.Write(echo)
+
+            try:
+                header = await asyncio.wait_for(self.ReadExactly(len(echo)), 60)
+                if header != echo:                                      # Echo off, put the bytes back.
+                    self.data[0:0] = header
+                length = struct.unpack(">H", await asyncio.wait_for(self.ReadExactly(2), 60))[0]
+                payload = await asyncio.wait_for(self.ReadExactly(length), 60)
+                checksum = struct.unpack(">H", await asyncio.wait_for(self.ReadExactly(2), 60))[0]
+                await asyncio.wait_for(self.ReadResponse("", "OK"), 10)
+            except asyncio.TimeoutError:
+                Iridium.Log("GetBinary(): Timed out reading message.")
+                return None
+
+        if checksum != Iridium.SbdChecksum(payload):
+            Iridium.Log("GetBinary(): Checksum mismatch, message discarded.")
+            return None
+
+        return payload
+
+    async def GetSbdStatus(self):
+        """ As Iridium.GetSbdStatus."""
+        status = Iridium.ParseReply(await self.WriteAndReceive("AT+SBDSX\r", "+SBDSX:", 90) or "")
+
+        if status is None:
+            return None
+
+        Iridium.Notify(self.serialPort, "+SBDSX", status)
+        return status
+
+    async def DrainSBD(self, Binary=False, Answer=False, Budget=None, Result=None):
+        """ Async generator version of Iridium.DrainSBD, yielding (MTMSN, message)."""
+        budget = Budget or Iridium.RetryBudget()
+        budget.Start()
+        command = "AT+SBDIXA\r" if Answer else "AT+SBDIX\r"
+        isMoOk = False
+        isMtOk = False
+        MTqueued = 0
+
+        while isMoOk == False or isMtOk == False or MTqueued > 0:
+            reply = Iridium.ParseReply(await self.WriteAndReceive(command, "+SBDIX:", Iridium.SessionTimeout) or "")
+            command = "AT+SBDIX\r"
+
+            if reply is None:
+                Iridium.Log("No reply received.")
+                if not await self.Backoff(budget):
+                    return
+                continue
+
+            MOstatus, MOmsn, MTstatus, MTmsn, MTlength, MTqueued = reply
+            Iridium.Notify(self.serialPort, "+SBDIX", reply)
+            IridiumMetrics.metrics.Session(MOstatus, MTstatus)
+            if Result is not None:
+                Result.Replies.append(reply)
+
+            isMoOk = Iridium.ProcessMoStatus(MOstatus)
+            isMtOk = Iridium.MtStatusCodes.get(MTstatus, (False, ""))[0]
+
+            if isMoOk and not await self.WriteAndCheck("AT+SBDD0\r", "0", 20):     # Sending doesn't clear the MO buffer, don't send it again.
+                Iridium.Log("Issue clearing MO buffer.")
+
+            if MTstatus == 1:
+                mtMsg = await (self.GetBinary() if Binary else self.GetText())
+
+                if MTmsn in self.seenMtMsns:
+                    Iridium.Log("Already received MTMSN " + str(MTmsn) + ". Skipping duplicate.")
+                elif mtMsg:
+                    self.seenMtMsns.append(MTmsn)
+                    yield MTmsn, mtMsg
+
+            if not (isMoOk and isMtOk) and not await self.Backoff(budget):  # The budget only bounds failures, a healthy drain runs to the end.
+                return
+
+    async def Backoff(self, budget):
+        """ Waits out the RetryBudget's delay after a failed session. Returns False, having reported it, if the budget is exhausted."""
+        delay = budget.Failed()
+
+        if delay is None:
+            budget.Report(self.serialPort)
+            return False
+
+        IridiumMetrics.metrics.Count("retries")
+        await asyncio.sleep(delay)
+        return True
+
+    async def InitiateSBD(self, Binary=False, Budget=None):
+        """ As Iridium.InitiateSBD, returns an Iridium.SessionResult."""
+        result = Iridium.SessionResult()
+        result.extend([mtMsg async for MTmsn, mtMsg in self.DrainSBD(Binary, Budget=Budget, Result=result)])
+        return result
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+""" Compact binary codec for status telemetry sent with BufferSbdBinary. A Schema declares the fields of a status report and reports are
+bit-packed with each field in only the bits its range needs. Several reports go in one payload, each after the first carrying only the
+fields that changed from the one before. The first is sent the same way against the last report the other end is known to have, the base,
+so a payload of unchanged reports is a few bits each. Text and Choice fields take a dictionary of common values sent as an index.
+
+The base is tracked by sequence number: MOMSN for MO payloads, MTMSN for MT. The Encoder only uses a payload as a base once it's
+acknowledged, e.g. by a successful +SBDIX session for its MOMSN, and the Decoder keeps the last report of each payload it decodes under its
+sequence number.
+
+    schema = Schema(1, [Fixed("azimuth", 0, 360, 0.1, DeltaBits=6), Fixed("elevation", -10, 90, 0.1, DeltaBits=6),
+                        Fixed("temperature", -40, 85, 0.5, DeltaBits=4), Flag("locked"), Choice("mode", ["idle", "track", "stow"])])
+    encoder = Encoder(schema)
+    Iridium.Subscribe("+SBDIX", encoder.OnSession)
+    payload, count = encoder.Fit(reports, Iridium.GetSbdStatus(serialPort).MoMsn)
+    Iridium.BufferSbdBinary(serialPort, payload)
+
+    Decoder([schema]).Decode(payload, momsn)                            # -> reports as dicts
+
+MT payloads are decoded the same way as they arrive, read with Binary=True as text SBD can't carry them:
+
+    for MTmsn, mtMsg in Iridium.DrainSBD(serialPort, Binary=True):
+        reports = decoder.Decode(mtMsg, MTmsn)
+
+Payload: {1-byte schema id << 2 | has base << 1} [{2-byte base sequence number}] {1-byte report count} {bit-packed reports}"""
+import struct
+from collections import OrderedDict
+
+MaxBytes = 340                                                          # Iridium.MaxMoBytes. MT payloads are limited to 270.
+MaxReports = 255
+HasBase = 0x02
+Header = struct.Struct(">B")
+BaseHeader = struct.Struct(">BH")
+
+class CodecError(ValueError):
+    pass
+
+def BitLength(Value):
+    return max(1, int(Value).bit_length())
+
+class BitWriter(object):
+
+    def __init__(self):
+        self.value = 0
+        self.bits = 0
+
+    def Write(self, Value, Bits):
+        self.value = (self.value << Bits) | (Value & ((1 << Bits) - 1))
+        self.bits += Bits
+
+    def Mark(self):
+        return self.value, self.bits
+
+    def Rewind(self, Mark):
+        self.value, self.bits = Mark
+
+    def Size(self):
+        return (self.bits + 7) // 8
+
+    def Bytes(self):
+        size = self.Size()
+        value = self.value << (size * 8 - self.bits)                    # Pad the last byte with zero bits.
+        return bytes(bytearray((value >> (8 * (size - 1 - i))) & 0xFF for i in range(size)))
+
+class BitReader(object):
+
+    def __init__(self, Data):
+        data = bytearray(Data)
+        self.value = 0
+        for byte in data:
+            self.value = (self.value << 8) | byte
+        self.bits = len(data) * 8
+        self.position = 0
+
+    def Read(self, Bits):
+        if self.position + Bits > self.bits:
+            raise CodecError("Payload too short.")
+
+        self.position += Bits
+        return (self.value >> (self.bits - self.position)) & ((1 << Bits) - 1)
+
+class Field(object):
+    """ Unsigned integer of Bits bits. Other field types map their values onto one. With DeltaBits a changed value within a DeltaBits
+    signed difference of the one before is sent as the difference instead of in full."""
+
+    def __init__(self, Name, Bits, DeltaBits=0):
+        self.Name = Name
+        self.Bits = Bits
+        self.DeltaBits = DeltaBits
+
+    def ToRaw(self, Value):
+        raw = int(Value)
+        if not 0 <= raw < 1 << self.Bits:
+            raise CodecError(self.Name + " = " + repr(Value) + " doesn't fit in " + str(self.Bits) + " bits.")
+        return raw
+
+    def FromRaw(self, Raw):
+        return Raw
+
+    def Same(self, A, B):
+        """ True if A and B are sent as the same value."""
+        return self.ToRaw(A) == self.ToRaw(B)
+
+    def Pack(self, writer, Value, Previous=None):
+        """ Writes Value, as a difference from Previous (both values) if there is one and it's close enough."""
+        raw = self.ToRaw(Value)
+
+        if self.DeltaBits and Previous is not None:
+            delta = raw - self.ToRaw(Previous)
+            limit = 1 << (self.DeltaBits - 1)
+            isDelta = -limit <= delta < limit
+            writer.Write(isDelta, 1)
+            if isDelta:
+                writer.Write(delta, self.DeltaBits)
+                return
+
+        writer.Write(raw, self.Bits)
+
+    def Unpack(self, reader, Previous=None):
+        if self.DeltaBits and Previous is not None and reader.Read(1):
+            delta = reader.Read(self.DeltaBits)
+            if delta >= 1 << (self.DeltaBits - 1):
+                delta -= 1 << self.DeltaBits
+            return self.FromRaw(self.ToRaw(Previous) + delta)
+
+        return self.FromRaw(reader.Read(self.Bits))
+
+class Int(Field):
+    """ Signed integer of Bits bits."""
+
+    def ToRaw(self, Value):
+        return Field.ToRaw(self, int(Value) + (1 << (self.Bits - 1)))
+
+    def FromRaw(self, Raw):
+        return Raw - (1 << (self.Bits - 1))
+
+class Fixed(Field):
+    """ Number from Minimum to Maximum to the nearest Resolution. Values outside the range are sent as the nearest end of it."""
+
+    def __init__(self, Name, Minimum, Maximum, Resolution, DeltaBits=0):
+        self.Minimum = Minimum
+        self.Resolution = Resolution
+        self.steps = int(round((Maximum - Minimum) / float(Resolution)))
+        Field.__init__(self, Name, BitLength(self.steps), DeltaBits)
+
+    def ToRaw(self, Value):
+        return min(self.steps, max(0, int(round((Value - self.Minimum) / float(self.Resolution)))))
+
+    def FromRaw(self, Raw):
+        return round(self.Minimum + Raw * self.Resolution, 9)
+
+class Flag(Field):
+
+    def __init__(self, Name):
+        Field.__init__(self, Name, 1)
+
+    def ToRaw(self, Value):
+        return 1 if Value else 0
+
+    def FromRaw(self, Raw):
+        return bool(Raw)
+
+class Choice(Field):
+    """ One of a fixed list of Values, sent as its index."""
+
+    def __init__(self, Name, Values):
+        self.Values = list(Values)
+        self.index = dict((value, i) for i, value in enumerate(self.Values))
+        Field.__init__(self, Name, BitLength(len(self.Values) - 1))
+
+    def ToRaw(self, Value):
+        if Value not in self.index:
+            raise CodecError(self.Name + " = " + repr(Value) + " isn't one of its values.")
+        return self.index[Value]
+
+    def FromRaw(self, Raw):
+        if Raw >= len(self.Values):
+            raise CodecError(self.Name + " index " + str(Raw) + " out of range.")
+        return self.Values[Raw]
+
+class Text(Field):
+    """ String of up to 255 bytes (UTF-8). One of Words is sent as its index, anything else as a length and the bytes."""
+
+    def __init__(self, Name, Words=()):
+        self.Words = list(Words)
+        self.index = dict((word, i) for i, word in enumerate(self.Words))
+        Field.__init__(self, Name, BitLength(len(self.Words) - 1) if self.Words else 0)
+
+    def Same(self, A, B):
+        return A == B
+
+    def Pack(self, writer, Value, Previous=None):
+        if Value in self.index:
+            writer.Write(1, 1)
+            writer.Write(self.index[Value], self.Bits)
+            return
+
+        data = bytearray(Value.encode("utf-8") if not isinstance(Value, bytes) else Value)
+        if len(data) > 255:
+            raise CodecError(self.Name + " is longer than 255 bytes.")
+
+        if self.Words:
+            writer.Write(0, 1)
+        writer.Write(len(data), 8)
+        for byte in data:
+            writer.Write(byte, 8)
+
+    def Unpack(self, reader, Previous=None):
+        if self.Words and reader.Read(1):
+            index = reader.Read(self.Bits)
+            if index >= len(self.Words):
+                raise CodecError(self.Name + " index " + str(index) + " out of range.")
+            return self.Words[index]
+
+        length = reader.Read(8)
+        return bytes(bytearray(reader.Read(8) for _ in range(length))).decode("utf-8")
+
+class Schema(object):
+    """ Id (0-63) identifies the schema in each payload so a Decoder can take several. Fields is the list of fields in a report."""
+
+    def __init__(self, Id, Fields):
+        if not 0 <= Id < 64:
+            raise CodecError("Schema id must be 0-63.")
+
+        self.Id = Id
+        self.Fields = list(Fields)
+
+    def PackReport(self, writer, Report, Previous=None):
+        """ Writes Report, a dict with a value for every field. After a Previous report each field starts with a changed bit and only
+        changed fields follow."""
+        for field in self.Fields:
+            value = Report[field.Name]
+
+            if Previous is None:
+                field.Pack(writer, value)
+                continue
+
+            previous = Previous[field.Name]
+            changed = not field.Same(value, previous)
+            writer.Write(changed, 1)
+            if changed:
+                field.Pack(writer, value, previous)
+
+    def UnpackReport(self, reader, Previous=None):
+        report = {}
+
+        for field in self.Fields:
+            if Previous is None:
+                report[field.Name] = field.Unpack(reader)
+            elif reader.Read(1):
+                report[field.Name] = field.Unpack(reader, Previous[field.Name])
+            else:
+                report[field.Name] = Previous[field.Name]
+
+        return report
+
+class Encoder(object):
+    """ Encodes reports against the last acknowledged payload. Payloads given a sequence number are remembered till Ack() confirms the
+    other end has them."""
+
+    def __init__(self, schema, MaxBytes=MaxBytes, MaxPending=16):
+        self.schema = schema
+        self.MaxBytes = MaxBytes
+        self.MaxPending = MaxPending
+        self.base = None                                                # (sequence number, last report) of the last acknowledged payload.
+        self.pending = OrderedDict()                                    # Sequence number -> last report of a payload not yet acknowledged.
+
+    def Encode(self, Reports, Msn=None):
+        """ Encodes all of Reports into one payload, raising CodecError if they don't fit in MaxBytes."""
+        payload, count = self.Fit(Reports, Msn)
+
+        if count < len(Reports):
+            raise CodecError(str(len(Reports)) + " reports don't fit in " + str(self.MaxBytes) + " bytes.")
+
+        return payload
+
+    def Fit(self, Reports, Msn=None):
+        """ Encodes as many of Reports, from the first, as fit in MaxBytes. Returns (payload, number of reports in it). Msn is the sequence
+        number the payload will be sent with, the MOMSN of the next session for MO, so it can be the base once acknowledged."""
+        header = Header if self.base is None else BaseHeader
+        writer = BitWriter()
+        previous = None if self.base is None else self.base[1]
+        count = 0
+
+        for report in Reports[:MaxReports]:
+            mark = writer.Mark()
+            self.schema.PackReport(writer, report, previous)
+
+            if header.size + 1 + writer.Size() > self.MaxBytes:                # 1 byte for the report count.
+                writer.Rewind(mark)
+                break
+
+            previous = report
+            count += 1
+
+        if self.base is None:
+            payload = Header.pack(self.schema.Id << 2)
+        else:
+            payload = BaseHeader.pack(self.schema.Id << 2 | HasBase, self.base[0])
+
+        payload += struct.pack(">B", count) + writer.Bytes()
+
+        if Msn is not None and count:
+            self.pending[Msn] = Reports[count - 1]
+            while len(self.pending) > self.MaxPending:
+                self.pending.popitem(last=False)
+
+        return payload, count
+
+    def Ack(self, Msn):
+        """ The payload sent as Msn has been delivered, so later payloads can be encoded against it."""
+        report = self.pending.pop(Msn, None)
+
+        if report is not None:
+            self.base = (Msn, report)
+
+    def Reset(self):
+        """ Forget the base, e.g. if the other end has lost its state, so the next payload is sent in full."""
+        self.base = None
+        self.pending.clear()
+
+    def OnSession(self, serialPort, Code, Values):
+        """ +SBDIX subscriber acknowledging MO payloads by MOMSN when their session succeeds."""
+        if Values[0] <= 8:
+            self.Ack(Values[1])
+
+class Decoder(object):
+    """ Decodes payloads from an Encoder using any of Schemas, keeping the last report of the last MaxStates payloads as bases."""
+
+    def __init__(self, Schemas, MaxStates=64):
+        self.schemas = dict((schema.Id, schema) for schema in Schemas)
+        self.MaxStates = MaxStates
+        self.states = OrderedDict()                                     # Sequence number -> (schema id, last report).
+
+    def Decode(self, Payload, Msn=None):
+        """ Returns the list of reports in Payload, a dict each. Msn is the sequence number it came with (MOMSN or MTMSN), needed for it to
+        be used as a base later. Raises CodecError if it's malformed or its base hasn't been decoded here."""
+        payload = bytes(Payload)
+
+        if len(payload) < Header.size + 1:
+            raise CodecError("Payload too short.")
+
+        flags = Header.unpack_from(payload)[0]
+        schema = self.schemas.get(flags >> 2)
+        if schema is None:
+            raise CodecError("Unknown schema " + str(flags >> 2) + ".")
+
+        previous = None
+        offset = Header.size
+        if flags & HasBase:
+            if len(payload) < BaseHeader.size + 1:
+                raise CodecError("Payload too short.")
+            base = BaseHeader.unpack_from(payload)[1]
+            if base not in self.states or self.states[base][0] != schema.Id:
+                raise CodecError("Base " + str(base) + " not known.")
+            previous = self.states[base][1]
+            offset = BaseHeader.size
+
+        count = struct.unpack_from(">B", payload, offset)[0]
+        reader = BitReader(payload[offset + 1:])
+        reports = []
+
+        for _ in range(count):
+            previous = schema.UnpackReport(reader, previous)
+            reports.append(previous)
+
+        if Msn is not None and reports:
+            self.states[Msn] = (schema.Id, reports[-1])
+            while len(self.states) > self.MaxStates:
+                self.states.popitem(last=False)
+
+        return reports
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+""" Iridium daemon. One process owns the RockBLOCK and sends for any number of local clients over ZMQ, so they don't each open the serial
+port and contend for it.
+
+Clients connect a REQ or DEALER socket to the ROUTER endpoint and send one of:
+    [b"SEND", message]  ->  [b"QUEUED", id]         Message accepted, id is its transport message id.
+                            [b"BUSY", backlog]      Outbound backlog full, try again later.
+                            [b"ERROR", reason]      Message refused, e.g. too big.
+    [b"STATUS"]         ->  [b"STATUS", json]       Backlog, session counts and per client statistics.
+
+Queued messages are packed together by IridiumTransport, so one SBD session carries as many as fit in a payload. A session starts once
+the oldest message has waited BatchDelay seconds or a full payload is waiting. The PUB endpoint carries:
+    [b"MT", message]                                MT message received, reassembled.
+    [b"MTRAW", payload]                             MT payload that isn't transport framed, e.g. sent from the RockBLOCK console.
+    [b"DELIVERED", client, id, json]                Message sent, with the seconds it took from being queued.
+    [b"IridiumClients", json]                       Per client statistics every IridiumMetrics.Interval seconds.
+    [b"IridiumMetrics", json]                       IridiumMetrics snapshot, at the same time.
+
+Clients are named by their ZMQ routing id, so set zmq.IDENTITY on the client socket to pick out its own DELIVERED messages.
+
+Usage: python IridiumDaemon.py /dev/ttyUSB0 [--router tcp://127.0.0.1:5570] [--pub tcp://127.0.0.1:5571] [--backlog 64] [--batch-delay 5]"""
+import argparse, binascii, json, os, signal, time, traceback
+try:
+    import Queue
+except ImportError:                                                     # Python 3
+    import queue as Queue
+import zmq
+import Iridium, IridiumMetrics, IridiumModem, IridiumTransport
+
+RouterEndpoint = "tcp://127.0.0.1:5570"
+PubEndpoint = "tcp://127.0.0.1:5571"
+
+class Client(object):
+    """ Statistics for one client. Latency is from a message being queued to its session succeeding."""
+
+    def __init__(self, Name):
+        self.Name = Name
+        self.first = time.time()
+        self.last = self.first
+        self.queued = 0
+        self.busy = 0                                                   # Messages refused with BUSY.
+        self.refused = 0                                                # Messages refused with ERROR.
+        self.delivered = 0
+        self.bytes = 0                                                  # Bytes delivered.
+        self.latency = IridiumMetrics.Histogram()
+
+    def Snapshot(self):
+        hours = max(time.time() - self.first, 1) / 3600.0
+        return {"queued": self.queued, "busy": self.busy, "refused": self.refused, "delivered": self.delivered, "bytes": self.bytes,
+                "perHour": round(self.delivered / hours, 1), "latency": self.latency.Snapshot(), "lastSeen": round(self.last, 3)}
+
+def ClientName(Identity):
+    """ Printable name for a routing id. ZMQ's generated ids are binary, so those are given in hex."""
+    try:
+        name = Identity.decode("ascii")
+        if name and all(" " <= char <= "~" for char in name):
+            return name
+    except UnicodeDecodeError:
+        pass
+
+    return binascii.hexlify(Identity).decode("ascii")
+
+class Daemon(object):
+    """ Owns the modem on serialPort through an IridiumModem.Modem and serves clients from Run(). At most MaxBacklog messages are held,
+    counting those in a session; beyond that SEND gets BUSY. A session that fails for SessionSeconds is tried again RetryDelay seconds later."""
+
+    def __init__(self, serialPort, Router=RouterEndpoint, Pub=PubEndpoint, MaxBacklog=64, BatchDelay=5, SessionSeconds=300, RetryDelay=60,
+                 context=None):
+        self.MaxBacklog = MaxBacklog
+        self.BatchDelay = BatchDelay
+        self.SessionSeconds = SessionSeconds
+        self.RetryDelay = RetryDelay
+
+        self.context = context or zmq.Context.instance()
+        self.router = self.context.socket(zmq.ROUTER)
+        self.router.bind(Router)
+        self.pub = self.context.socket(zmq.PUB)
+        self.pub.bind(Pub)
+
+        self.transport = IridiumTransport.Transport(serialPort)
+        self.pending = {}                                               # Message id -> (client name, time queued, length)
+        self.oldest = None                                              # Time the oldest message not yet in a session was queued.
+        self.inFlight = None                                            # (payload, message ids it completes) while in a session or waiting to retry.
+        self.busy = False                                               # Session running on the modem.
+        self.retryAt = 0
+        self.sessions = 0
+        self.failed = 0
+        self.clients = {}
+        self.published = time.time()
+
+        self.events = Queue.Queue()                                     # Session outcomes and ring alert messages from the modem's threads.
+        self.wakeRead, self.wakeWrite = os.pipe()
+        self.running = True
+
+        self.modem = IridiumModem.Modem(serialPort, OnMessage=self.OnMessage, Binary=True)
+        self.modem.Submit(Iridium.Configure)
+
+    def Close(self):
+        self.modem.Close()
+        self.modem.serialPort.close()
+        self.router.close(0)
+        self.pub.close(0)
+        os.close(self.wakeRead)
+        os.close(self.wakeWrite)
+
+    def Stop(self):
+        """ Makes Run() return. Safe from a signal handler or another thread."""
+        self.running = False
+        os.write(self.wakeWrite, b"x")
+
+    def Post(self, Event):
+        self.events.put(Event)
+        os.write(self.wakeWrite, b"x")
+
+    def OnMessage(self, MTmsn, mtMsg):
+        """ Ring alert messages, from the modem's delivery thread."""
+        self.Post(("mt", [mtMsg]))
+
+    def GetClient(self, Name):
+        client = self.clients.get(Name)
+        if client is None:
+            client = self.clients[Name] = Client(Name)
+        client.last = time.time()
+        return client
+
+    def Run(self):
+        poller = zmq.Poller()
+        poller.register(self.router, zmq.POLLIN)
+        poller.register(self.wakeRead, zmq.POLLIN)
+
+        while self.running:
+            for socket, _ in poller.poll(self.NextWake() * 1000):
+                if socket is self.router:
+                    self.Receive()
+                else:
+                    os.read(self.wakeRead, 64)
+
+            self.HandleEvents()
+            self.StartSession()
+            self.PublishStats()
+
+    def NextWake(self):
+        """ Seconds till there's something to do without a request or event: the next batch, retry or statistics message."""
+        now = time.time()
+        times = []
+
+        if IridiumMetrics.Interval:
+            times.append(self.published + IridiumMetrics.Interval)
+        if not self.busy and self.inFlight is not None:
+            times.append(self.retryAt)
+        elif not self.busy and self.oldest is not None:
+            times.append(self.oldest + self.BatchDelay)
+
+        return max(0, min(times) - now) if times else 60
+
+    def Receive(self):
+        while True:
+            try:
+                frames = self.router.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+
+            split = 2 if len(frames) > 1 and frames[1] == b"" else 1   # REQ clients put an empty delimiter after their routing id.
+            envelope, request = frames[:split], frames[split:]
+
+            try:
+                reply = self.Request(ClientName(frames[0]), request)
+            except Exception:
+                Iridium.Log("Daemon: Error handling request:")
+                Iridium.Log(traceback.format_exc())
+                reply = [b"ERROR", b"Internal error."]
+
+            self.router.send_multipart(envelope + reply)
+
+    def Request(self, Name, Request):
+        client = self.GetClient(Name)
+        command = Request[0] if Request else b""
+
+        if command == b"SEND" and len(Request) == 2:
+            return self.Queue(client, Request[1])
+        elif command == b"STATUS":
+            return [b"STATUS", json.dumps(self.Status(), separators=(",", ":"), sort_keys=True).encode("utf-8")]
+
+        client.refused += 1
+        return [b"ERROR", b"Unknown request."]
+
+    def Queue(self, client, Message):
+        if len(self.pending) >= self.MaxBacklog:
+            client.busy += 1
+            IridiumMetrics.metrics.Count("daemonBusy")
+            Iridium.Log("Daemon: Backlog full, " + client.Name + " told to wait.", RateLimit=True)
+            return [b"BUSY", str(len(self.pending)).encode("ascii")]
+
+        msgId = self.transport.Queue(Message)
+        if msgId is None:
+            client.refused += 1
+            return [b"ERROR", b"Message too big."]
+
+        now = time.time()
+        self.pending[msgId] = (client.Name, now, len(Message))
+        if self.oldest is None:
+            self.oldest = now
+        client.queued += 1
+
+        return [b"QUEUED", str(msgId).encode("ascii")]
+
+    def QueuedBytes(self):
+        return IridiumTransport.PayloadHeader.size + sum(len(data) - offset + IridiumTransport.Header.size for msgId, data, offset, index in self.transport.outbound)
+
+    def StartSession(self):
+        """ Hands the next payload to the modem if one is due. A failed payload is retried as it was, so it's never split differently."""
+        now = time.time()
+
+        if self.busy:
+            return
+
+        if self.inFlight is None:
+            if self.oldest is None:
+                return
+            if now < self.oldest + self.BatchDelay and self.QueuedBytes() < self.transport.MaxPayload:
+                return
+
+            payload = self.transport.NextPayload()
+            epoch, records = IridiumTransport.UnpackRecords(payload)
+            completes = [msgId for msgId, index, isLast, data in records if isLast]
+            self.inFlight = (payload, completes)
+            if not self.transport.outbound:                             # Anything left over has waited long enough already.
+                self.oldest = None
+        elif now < self.retryAt:
+            return
+
+        self.busy = True
+        self.sessions += 1
+        self.modem.Submit(self.Session, self.inFlight[0])
+
+    def Session(self, serialPort, Payload):
+        """ Runs on the modem's I/O thread. Sends Payload and posts whether it went and the MT payloads received."""
+        result = Iridium.SessionResult()
+
+        try:
+            if Iridium.BufferSbdBinary(serialPort, Payload):
+                result = Iridium.InitiateSBD(serialPort, Binary=True, Budget=Iridium.RetryBudget(MaxSeconds=self.SessionSeconds))
+        finally:
+            self.Post(("session", (result.Delivered is not None, list(result))))
+
+    def HandleEvents(self):
+        while True:
+            try:
+                kind, values = self.events.get_nowait()
+            except Queue.Empty:
+                return
+
+            if kind == "session":
+                self.busy = False
+                delivered, mtMsgs = values
+                self.Settle(delivered)
+            else:
+                mtMsgs = values
+
+            for mtMsg in mtMsgs:
+                messages = self.transport.reassembler.Add(mtMsg)
+                if messages is None:                                    # Not transport framed, e.g. text from the RockBLOCK console.
+                    self.pub.send_multipart([b"MTRAW", bytes(mtMsg)])
+                    continue
+                for message in messages:
+                    self.pub.send_multipart([b"MT", message])
+
+    def Settle(self, Delivered):
+        """ Confirms the messages the last session completed, or schedules its payload to be tried again."""
+        if not Delivered:
+            self.failed += 1
+            self.retryAt = time.time() + self.RetryDelay
+            Iridium.Log("Daemon: Session failed, " + str(len(self.pending)) + " messages held. Retrying in " + str(self.RetryDelay) + "s.")
+            return
+
+        now = time.time()
+
+        for msgId in self.inFlight[1]:
+            name, queued, length = self.pending.pop(msgId)
+            client = self.GetClient(name)
+            client.delivered += 1
+            client.bytes += length
+            client.latency.Add(now - queued)
+            IridiumMetrics.metrics.Time("daemonLatency", now - queued)
+
+            confirmation = json.dumps({"latency": round(now - queued, 3), "bytes": length}, separators=(",", ":")).encode("utf-8")
+            self.pub.send_multipart([b"DELIVERED", name.encode("utf-8"), str(msgId).encode("ascii"), confirmation])
+
+        self.inFlight = None
+
+    def Status(self):
+        return {"backlog": len(self.pending), "maxBacklog": self.MaxBacklog, "queuedBytes": self.QueuedBytes(), "busy": self.busy,
+                "sessions": self.sessions, "failed": self.failed, "signal": self.modem.State()["signal"],
+                "clients": dict((name, client.Snapshot()) for name, client in self.clients.items())}
+
+    def PublishStats(self):
+        if not IridiumMetrics.Interval or time.time() < self.published + IridiumMetrics.Interval:
+            return
+
+        self.published = time.time()
+        self.pub.send_multipart([b"IridiumClients", json.dumps(self.Status(), separators=(",", ":"), sort_keys=True).encode("utf-8")])
+        self.pub.send_multipart([b"IridiumMetrics", IridiumMetrics.metrics.Encode()])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shares a RockBLOCK between local clients over ZMQ.")
+    parser.add_argument("port", help="Serial port of the RockBLOCK, e.g. /dev/ttyUSB0.")
+    parser.add_argument("--baud", type=int, default=19200)
+    parser.add_argument("--router", default=RouterEndpoint, help="Endpoint clients send requests to.")
+    parser.add_argument("--pub", default=PubEndpoint, help="Endpoint MT messages, confirmations and statistics are published on.")
+    parser.add_argument("--backlog", type=int, default=64, help="Messages held before clients are told BUSY.")
+    parser.add_argument("--batch-delay", type=float, default=5, help="Seconds a message waits for others to share its session.")
+    parser.add_argument("--state", help="ModemState file, see Iridium.SetStateFile.")
+    args = parser.parse_args()
+
+    if args.state:
+        Iridium.SetStateFile(args.state)
+
+    daemon = Daemon(Iridium.OpenSerial(args.port, args.baud), args.router, args.pub, args.backlog, args.batch_delay)
+    signal.signal(signal.SIGTERM, lambda *args: daemon.Stop())
+    signal.signal(signal.SIGINT, lambda *args: daemon.Stop())
+
+    Iridium.Log("Daemon: Serving " + args.port + " on " + args.router + ", publishing on " + args.pub + ".")
+    try:
+        daemon.Run()
+    finally:
+        daemon.Close()
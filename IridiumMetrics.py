@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+""" Runtime metrics for the Iridium functions: latency histograms per AT command, SBD session outcomes by MO and MT status, retries, bytes
+moved, time spent sleeping and signal readings. Iridium records into the module wide Metrics object as it goes, Snapshot() reads it
+in-process and the Iridium log worker publishes it every Interval seconds on the ZMQ socket given to Iridium.SetZmqSock, as a compact JSON
+message with topic IridiumMetrics."""
+import bisect, json, threading, time
+
+Interval = 60                                                           # Seconds between metrics messages on the ZMQ socket. 0 turns them off.
+Bounds = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90)               # Histogram bucket upper bounds in seconds, the last bucket is anything longer.
+
+class Histogram(object):
+    """ Fixed bucket latency histogram. Failed is the number of calls that timed out or got the wrong reply. Snapshots carry the p50 and
+    p99 latencies as bucket upper bounds."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(Bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.failed = 0
+
+    def Add(self, Seconds, Ok=True):
+        self.buckets[bisect.bisect_left(Bounds, Seconds)] += 1
+        self.count += 1
+        self.total += Seconds
+        self.max = max(self.max, Seconds)
+        if not Ok:
+            self.failed += 1
+
+    def Percentile(self, Percent):
+        """ Upper bound of the bucket holding the Percent percentile, or None if nothing has been recorded."""
+        if not self.count:
+            return None
+
+        target = self.count * Percent / 100.0
+        running = 0
+        for bound, count in zip(Bounds, self.buckets):
+            running += count
+            if running >= target:
+                return bound
+
+        return round(self.max, 3)
+
+    def Snapshot(self):
+        return {"n": self.count, "sum": round(self.total, 3), "max": round(self.max, 3), "failed": self.failed, "buckets": list(self.buckets),
+                "p50": self.Percentile(50), "p99": self.Percentile(99)}
+
+class Metrics(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.Reset()
+
+    def Reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.timings = {}                                           # Command or operation name -> Histogram.
+            self.counters = {}                                          # Counter name -> count, e.g. retries, bytes.
+            self.moStatus = {}                                          # MO status code -> sessions.
+            self.mtStatus = {}                                          # MT status code -> sessions.
+            self.signal = [0] * 6                                       # Readings of each bar count 0-5.
+            self.lastSignal = None
+
+    def Time(self, Name, Seconds, Ok=True):
+        with self.lock:
+            histogram = self.timings.get(Name)
+            if histogram is None:
+                histogram = self.timings[Name] = Histogram()
+            histogram.Add(Seconds, Ok)
+
+    def Count(self, Name, Amount=1):
+        with self.lock:
+            self.counters[Name] = self.counters.get(Name, 0) + Amount
+
+    def Session(self, MoStatus, MtStatus):
+        with self.lock:
+            self.moStatus[MoStatus] = self.moStatus.get(MoStatus, 0) + 1
+            self.mtStatus[MtStatus] = self.mtStatus.get(MtStatus, 0) + 1
+            for name in ("sessions", "sessionsOk" if MoStatus <= 8 else "sessionsFailed"):
+                self.counters[name] = self.counters.get(name, 0) + 1
+
+    def Signal(self, Strength):
+        with self.lock:
+            if 0 <= Strength < len(self.signal):
+                self.signal[Strength] += 1
+            self.lastSignal = Strength
+
+    def Snapshot(self):
+        """ Everything recorded since start or the last Reset() as a dict of plain types. Status code keys are strings so it survives JSON."""
+        with self.lock:
+            return {"time": round(time.time(), 3),
+                    "since": round(self.started, 3),
+                    "bounds": list(Bounds),
+                    "timings": dict((name, histogram.Snapshot()) for name, histogram in self.timings.items()),
+                    "counters": dict(self.counters),
+                    "moStatus": dict((str(code), count) for code, count in self.moStatus.items()),
+                    "mtStatus": dict((str(code), count) for code, count in self.mtStatus.items()),
+                    "signal": list(self.signal),
+                    "lastSignal": self.lastSignal}
+
+    def Encode(self):
+        """ Snapshot() as compact JSON bytes for the ZMQ message."""
+        return json.dumps(self.Snapshot(), separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+class Timer(object):
+    """ Times a with block into Metrics under Name. Set Ok to False inside the block to count the call as failed. Seconds is the time
+    taken once the block is done."""
+
+    def __init__(self, Name):
+        self.Name = Name
+        self.Ok = True
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.Seconds = time.time() - self.start
+        metrics.Time(self.Name, self.Seconds, self.Ok and args[0] is None)
+
+def CommandName(Command):
+    """ Metrics name for a command line: the command without arguments or CR, e.g. "AT+SBDWB=20\r" gives "AT+SBDWB". Anything that isn't an
+    AT command, such as the text of an SBD message, is "data"."""
+    name = Command.strip() if isinstance(Command, str) else ""          # Binary frames are bytes.
+
+    if not name.upper().startswith("AT"):
+        return "data"
+
+    return name.partition("=")[0]
+
+metrics = Metrics()
+
+def Snapshot():
+    return metrics.Snapshot()
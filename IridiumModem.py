@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+""" RockBLOCK modem owned by a single I/O thread. Any thread can submit Iridium functions to it and gets a Future back, so the port is never
+contended and callers aren't blocked for the length of a session. Unsolicited result codes are read while commands are in flight, keep a
+cached copy of the modem's state up to date and are passed to Iridium subscribers from a separate delivery thread."""
+import os, select, threading, time, traceback
+try:
+    import Queue
+except ImportError:                                                     # Python 3
+    import queue as Queue
+import Iridium
+
+class ModemTimeout(Exception):
+    pass
+
+class Future(object):
+    """ Result of a command submitted to a Modem."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def Done(self):
+        return self.event.is_set()
+
+    def Result(self, Timeout=None):
+        """ Waits for the command to finish and returns its result, re-raising any exception it raised."""
+        if not self.event.wait(Timeout):
+            raise ModemTimeout("Command still running after " + str(Timeout) + "s.")
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+    def SetResult(self, Result):
+        self.result = Result
+        self.event.set()
+
+    def SetError(self, Error):
+        self.error = Error
+        self.event.set()
+
+class Modem(object):
+    """ Owns serialPort on its own I/O thread. With OnMessage, ring alerts are answered and OnMessage(MTMSN, message) is called from the
+    delivery thread for each MT message received."""
+
+    def __init__(self, serialPort, OnMessage=None, Binary=False):
+        self.serialPort = serialPort
+        self.rxBuffer = Iridium.GetRxBuffer(serialPort)
+        self.OnMessage = OnMessage
+        self.Binary = Binary
+
+        self.commands = Queue.Queue()
+        self.deliveries = Queue.Queue()
+        self.wakeRead, self.wakeWrite = os.pipe()                       # Lets Submit() wake the I/O thread out of select().
+
+        self.stateLock = threading.Lock()
+        self.state = {"signal": None, "service": None, "sbdix": None, "sbdsx": None, "ring": False, "updated": {}}
+
+        self.running = True
+        self.rxBuffer.OnUnsolicited = self.OnUnsolicited
+        Iridium.Subscribe("+SBDIX", self.OnReply)
+        Iridium.Subscribe("+SBDSX", self.OnReply)
+
+        self.ioThread = threading.Thread(target=self.Run, name="IridiumModemIO")
+        self.deliveryThread = threading.Thread(target=self.Deliver, name="IridiumModemDelivery")
+        for thread in (self.ioThread, self.deliveryThread):
+            thread.daemon = True
+            thread.start()
+
+    def Close(self):
+        """ Stops the threads once the commands already submitted have run."""
+        self.running = False
+        os.write(self.wakeWrite, b"x")
+        self.ioThread.join()
+        self.deliveries.put(None)
+        self.deliveryThread.join()
+
+        self.rxBuffer.OnUnsolicited = None
+        Iridium.Unsubscribe("+SBDIX", self.OnReply)
+        Iridium.Unsubscribe("+SBDSX", self.OnReply)
+        os.close(self.wakeRead)
+        os.close(self.wakeWrite)
+
+    def Submit(self, Function, *args, **kwargs):
+        """ Queues Function(serialPort, *args, **kwargs), e.g. Submit(Iridium.BufferSbdMessage, "Hello"), and returns its Future."""
+        future = Future()
+        self.commands.put((future, Function, args, kwargs))
+        os.write(self.wakeWrite, b"x")
+        return future
+
+    def Call(self, Function, *args, **kwargs):
+        """ Submits Function and waits for its result."""
+        return self.Submit(Function, *args, **kwargs).Result()
+
+    def State(self):
+        """ Copy of the cached modem state: last signal and service indicators, last +SBDIX and +SBDSX values, whether a ring alert is
+        waiting, and when each was updated. Costs no serial traffic."""
+        with self.stateLock:
+            state = dict(self.state)
+            state["updated"] = dict(self.state["updated"])
+            return state
+
+    def SignalStrength(self, MaxAge=60):
+        """ Signal strength from the cache if it's less than MaxAge seconds old, otherwise asks the modem."""
+        with self.stateLock:
+            if self.state["signal"] is not None and time.time() - self.state["updated"].get("signal", 0) < MaxAge:
+                return self.state["signal"]
+
+        signalStr = self.Call(Iridium.CheckSignalStrength)
+        if signalStr is not None:
+            self.Update("signal", signalStr)
+        return signalStr
+
+    def Update(self, Key, Value):
+        with self.stateLock:
+            self.state[Key] = Value
+            self.state["updated"][Key] = time.time()
+
+    def OnUnsolicited(self, Code, Values):
+        """ Called on the I/O thread as soon as an unsolicited result code is read, even mid command."""
+        if Code == "+CIEV" and len(Values) == 2:
+            self.Update("signal" if Values[0] == 0 else "service", Values[1])
+        elif Code == "SBDRING":
+            self.Update("ring", True)
+
+    def OnReply(self, serialPort, Code, Values):
+        if serialPort is self.serialPort:
+            self.Update("sbdix" if Code == "+SBDIX" else "sbdsx", Values)
+
+    def Run(self):
+        while self.running or not self.commands.empty():
+            try:
+                future, function, args, kwargs = self.commands.get_nowait()
+            except Queue.Empty:
+                self.Listen()
+                continue
+
+            try:
+                future.SetResult(function(self.serialPort, *args, **kwargs))
+            except Exception as e:
+                Iridium.Log("Modem: Error running " + getattr(function, "__name__", str(function)) + ":")
+                Iridium.Log(traceback.format_exc())
+                future.SetError(e)
+
+            self.Forward()
+
+    def Listen(self):
+        """ Waits for modem output or a submitted command. Reads unsolicited output between commands."""
+        try:
+            readable, _, _ = select.select([self.serialPort.fileno(), self.wakeRead], [], [], 1)
+        except Exception:
+            readable = [self.wakeRead]
+            time.sleep(0.1)
+
+        if self.wakeRead in readable:
+            os.read(self.wakeRead, 64)
+
+        with self.rxBuffer.lock:
+            self.rxBuffer.Fill(0)
+            self.rxBuffer.Take(self.rxBuffer.lineScan)                  # No command running, the scanned lines are of no further use.
+
+        self.Forward()
+
+    def Forward(self):
+        """ Passes unsolicited codes read by the last command or Listen() to the delivery thread."""
+        while self.rxBuffer.unsolicited:
+            code, values = self.rxBuffer.unsolicited.popleft()
+            self.deliveries.put((code, values))
+
+            if code == "SBDRING" and self.OnMessage:
+                self.Submit(self.AnswerRing)
+
+    def AnswerRing(self, serialPort):
+        for MTmsn, mtMsg in Iridium.DrainSBD(serialPort, self.Binary, Answer=True):
+            self.deliveries.put(("message", (MTmsn, mtMsg)))
+        self.Update("ring", False)
+
+    def Deliver(self):
+        while True:
+            item = self.deliveries.get()
+            if item is None:
+                return
+
+            code, values = item
+
+            if code == "message":
+                try:
+                    self.OnMessage(*values)
+                except Exception:
+                    Iridium.Log("Modem: Error in OnMessage:")
+                    Iridium.Log(traceback.format_exc())
+            else:
+                Iridium.Log("Unsolicited: " + code + " " + str(values))
+                Iridium.Notify(self.serialPort, code, values)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+""" Pool of RockBLOCK units sharing one outbound workload. Each unit is an IridiumModem.Modem with its own I/O thread so sessions run in
+parallel. Messages go to whichever idle unit has the best signal; a unit reporting an antenna fault, disabled radio or busy transceiver (MO
+status 33-35) is rested with exponential backoff and its message goes to another unit. A message that can't be buffered is the message's
+fault, not the unit's, and any message still undelivered after MaxAttempts sessions fails with SendError. MT messages from all units come out
+of Receive()."""
+import logging, threading, time
+from collections import deque
+try:
+    import Queue
+except ImportError:                                                     # Python 3
+    import queue as Queue
+import Iridium, IridiumModem
+
+UnitFaults = (33, 34, 35)
+
+class SendError(Exception):
+    """ Raised by the future of a message the pool couldn't send."""
+
+class Unit(object):
+
+    def __init__(self, Name, modem):
+        self.Name = Name
+        self.modem = modem
+        self.busy = False
+        self.faults = 0                                                 # Consecutive unit faults.
+        self.restUntil = 0
+        self.sessions = 0
+        self.delivered = 0
+
+    def Signal(self):
+        signal = self.modem.State()["signal"]
+        return -1 if signal is None else signal
+
+class Pool(object):
+
+    def __init__(self, Ports, Baud=19200, Binary=False, BaseRest=30, MaxRest=900, MaxAttempts=10):
+        self.Binary = Binary
+        self.BaseRest = BaseRest
+        self.MaxRest = MaxRest
+        self.MaxAttempts = MaxAttempts
+        self.outbound = deque()                                         # (message, future, attempts so far)
+        self.received = Queue.Queue()
+        self.condition = threading.Condition()
+        self.running = True
+
+        self.units = []
+        for port in Ports:
+            unit = Unit(port, None)
+            unit.modem = IridiumModem.Modem(Iridium.OpenSerial(port, Baud), OnMessage=self.OnMessage(unit), Binary=Binary)
+            unit.modem.Submit(Iridium.Configure)
+            self.units.append(unit)
+
+        self.thread = threading.Thread(target=self.Run, name="IridiumPool")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+        for unit in self.units:
+            unit.modem.Close()
+            unit.modem.serialPort.close()
+
+    def OnMessage(self, unit):
+        return lambda MTmsn, mtMsg: self.received.put((unit.Name, MTmsn, mtMsg))
+
+    def Send(self, Message):
+        """ Queues Message and returns an IridiumModem.Future that resolves to the name of the unit that delivered it, or raises SendError if
+        the message is too big or can't be delivered."""
+        future = IridiumModem.Future()
+        maxBytes = Iridium.MaxMoBytes if self.Binary else Iridium.MaxTextBytes
+
+        if not 1 <= len(Message) <= maxBytes:
+            future.SetError(SendError("Message must be 1 to " + str(maxBytes) + " bytes, not " + str(len(Message)) + "."))
+            return future
+
+        with self.condition:
+            self.outbound.append((Message, future, 0))
+            self.condition.notify_all()
+
+        return future
+
+    def Receive(self, Timeout=None):
+        """ Next MT message from any unit as (unit name, MTMSN, message), or None if Timeout seconds pass first."""
+        try:
+            return self.received.get(timeout=Timeout)
+        except Queue.Empty:
+            return None
+
+    def Status(self):
+        """ Per unit name: busy, signal, consecutive faults, seconds left resting, sessions run and messages delivered."""
+        now = time.time()
+        with self.condition:
+            return dict((unit.Name, {"busy": unit.busy, "signal": unit.Signal(), "faults": unit.faults, "rest": max(0, unit.restUntil - now),
+                                     "sessions": unit.sessions, "delivered": unit.delivered}) for unit in self.units)
+
+    def PickUnit(self):
+        """ Idle, rested unit with the best signal, or None."""
+        now = time.time()
+        ready = [unit for unit in self.units if not unit.busy and unit.restUntil <= now]
+
+        if not ready:
+            return None
+
+        return max(ready, key=lambda unit: (unit.Signal(), -unit.faults))
+
+    def Run(self):
+        with self.condition:
+            while self.running:
+                unit = self.PickUnit() if self.outbound else None
+
+                if unit is None:
+                    rests = [unit.restUntil - time.time() for unit in self.units if not unit.busy and unit.restUntil > time.time()]
+                    self.condition.wait(min(rests) if rests else None)
+                    continue
+
+                message, future, attempts = self.outbound.popleft()
+                unit.busy = True
+                unit.modem.Submit(self.Session, unit, message, future, attempts + 1)
+
+    def Session(self, serialPort, unit, Message, future, Attempts):
+        """ Runs on the unit's I/O thread. Sends Message and settles the outcome with the pool."""
+        result = Iridium.SessionResult()
+
+        buffered = Iridium.BufferSbdBinary(serialPort, Message) if self.Binary else Iridium.BufferSbdMessage(serialPort, Message)
+        if buffered:
+            for MTmsn, mtMsg in Iridium.DrainSBD(serialPort, self.Binary, MaxAttempts=1, Result=result):     # Fail over rather than retry on this unit.
+                self.received.put((unit.Name, MTmsn, mtMsg))
+
+        moStatus = [reply.MOstatus for reply in result.Replies]
+        delivered = buffered and result.Delivered is not None
+
+        with self.condition:
+            unit.busy = False
+            unit.sessions += len(moStatus)
+
+            if delivered:
+                unit.faults = 0
+                unit.delivered += 1
+                future.SetResult(unit.Name)
+            else:
+                if buffered:
+                    rest = self.BaseRest                                # Don't hand the unit straight back the message it just failed.
+                    if any(status in UnitFaults for status in moStatus):
+                        unit.faults += 1
+                        rest = min(self.MaxRest, self.BaseRest * 2 ** (unit.faults - 1))
+                    unit.restUntil = time.time() + rest
+                    Iridium.Log("Pool: Resting " + unit.Name + " for " + str(rest) + "s. MO status: " + str(moStatus))
+                else:
+                    Iridium.Log("Pool: " + unit.Name + " couldn't buffer a " + str(len(Message)) + " byte message.", logging.WARNING)
+
+                if Attempts >= self.MaxAttempts:
+                    future.SetError(SendError("Not delivered after " + str(Attempts) + " attempts."))
+                else:
+                    self.outbound.appendleft((Message, future, Attempts))   # Straight back to the front for the next unit.
+
+            self.condition.notify_all()
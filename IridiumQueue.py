@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+""" Crash safe outbound message queue kept in an SQLite journal in front of the SBD send path.
+
+A message is marked in flight with the MOMSN the 9602 will use for it (from +SBDSX) before it's buffered and only removed once a +SBDIX
+reply reports that MOMSN sent. After a restart Recover() compares in flight messages with the modem's current MOMSN, which only moves on
+after a successful session, so each is either acknowledged or sent again, never both."""
+import sqlite3, threading, time
+import Iridium
+
+PriorityLow = 0
+PriorityNormal = 1
+PriorityHigh = 2
+PriorityAlarm = 3
+
+def AtOrAfter(Momsn, Marked):
+    """ True if Momsn is Marked or a later MOMSN, allowing for MOMSNs wrapping round at 65536."""
+    return (Momsn - Marked) & 0xFFFF < 0x8000
+
+class OutboundQueue(object):
+
+    def __init__(self, Path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(Path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")                     # Every commit is on disk before we go on to send.
+        self.db.execute("""CREATE TABLE IF NOT EXISTS outbound (
+                               id INTEGER PRIMARY KEY AUTOINCREMENT,
+                               priority INTEGER NOT NULL,
+                               key TEXT,
+                               message BLOB NOT NULL,
+                               momsn INTEGER,
+                               created REAL NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbound_order ON outbound (momsn, priority DESC, id)")
+        self.db.commit()
+
+    def Close(self):
+        with self.lock:
+            self.db.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM outbound").fetchone()[0]
+
+    def Put(self, Message, Priority=PriorityNormal, Key=None):
+        """ Stores Message and returns its id. A Key coalesces messages: any queued message with the same Key that isn't already in flight is
+        dropped, so e.g. only the newest antenna status gets sent."""
+        with self.lock, self.db:
+            if Key is not None:
+                self.db.execute("DELETE FROM outbound WHERE key = ? AND momsn IS NULL", (Key,))
+
+            cursor = self.db.execute("INSERT INTO outbound (priority, key, message, created) VALUES (?, ?, ?, ?)",
+                                     (Priority, Key, sqlite3.Binary(Message), time.time()))
+            return cursor.lastrowid
+
+    def Next(self):
+        """ Returns (id, message) for the highest priority, oldest message not in flight, or None if there isn't one."""
+        with self.lock:
+            row = self.db.execute("SELECT id, message FROM outbound WHERE momsn IS NULL ORDER BY priority DESC, id LIMIT 1").fetchone()
+
+        if row is None:
+            return None
+
+        return row[0], bytes(row[1])
+
+    def MarkInFlight(self, Id, Momsn):
+        with self.lock, self.db:
+            self.db.execute("UPDATE outbound SET momsn = ? WHERE id = ?", (Momsn, Id))
+
+    def Release(self, Id):
+        """ Puts an in flight message back in the queue to be sent again."""
+        with self.lock, self.db:
+            self.db.execute("UPDATE outbound SET momsn = NULL WHERE id = ?", (Id,))
+
+    def Ack(self, Momsn):
+        """ Removes the message a successful session with Momsn sent. That's the one marked with Momsn or, if a session's reply was lost
+        and the message went again with the retry, an earlier MOMSN. Returns True if there was one."""
+        with self.lock, self.db:
+            return self.db.execute("DELETE FROM outbound WHERE momsn IS NOT NULL AND ((? - momsn) & 65535) < 32768", (Momsn,)).rowcount > 0
+
+    def Recover(self, NextMomsn):
+        """ Settles messages left in flight by a crash, given the MOMSN the modem will use next. Anything sent with an earlier MOMSN got
+        through and is acknowledged, the rest go back in the queue."""
+        with self.lock, self.db:
+            acked = self.db.execute("DELETE FROM outbound WHERE momsn IS NOT NULL AND ((? - momsn) & 65535) BETWEEN 1 AND 32767",
+                                    (NextMomsn,)).rowcount
+            released = self.db.execute("UPDATE outbound SET momsn = NULL WHERE momsn IS NOT NULL").rowcount
+
+        if acked or released:
+            Iridium.Log("OutboundQueue.Recover(): " + str(acked) + " acknowledged, " + str(released) + " to resend.")
+
+    def Send(self, serialPort, Binary=False, Scheduler=None):
+        """ Sends queued messages one session each, highest priority first, till the queue is empty or a message fails to go. Returns the
+        MT messages received on the way."""
+        mtMsgList = []
+
+        status = Iridium.GetSbdStatus(serialPort)
+        if status is None:
+            Iridium.Log("OutboundQueue.Send(): Can't read MOMSN.")
+            return mtMsgList
+
+        self.Recover(status.MoMsn)
+
+        while True:
+            entry = self.Next()
+            if entry is None:
+                break
+
+            msgId, message = entry
+            momsn = status.MoMsn                                        # MOMSN the next session will use.
+            self.MarkInFlight(msgId, momsn)
+
+            buffered = Iridium.BufferSbdBinary(serialPort, message) if Binary else Iridium.BufferSbdMessage(serialPort, message)
+            if not buffered:
+                self.Release(msgId)
+                break
+
+            result = Iridium.InitiateSBD(serialPort, Binary, Scheduler)
+            mtMsgList.extend(result)
+
+            if result.Delivered is not None and AtOrAfter(result.Delivered.MOmsn, momsn):
+                self.Ack(result.Delivered.MOmsn)
+                Iridium.Log("OutboundQueue: Message " + str(msgId) + " sent as MOMSN " + str(result.Delivered.MOmsn) + ".")
+            else:
+                self.Release(msgId)
+                Iridium.Log("OutboundQueue: Message " + str(msgId) + " not sent. Left queued.")
+                break
+
+            status = Iridium.GetSbdStatus(serialPort)
+            if status is None:
+                break
+
+        return mtMsgList
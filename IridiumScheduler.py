@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+""" Signal and service aware SBD session scheduling. Keeps a live estimate of the link from the +CIEV indicator reports enabled by
+StartReporting and the MO status of recent +SBDIX sessions. Indicator reports are only read between commands with an Iridium.Dispatcher
+running on the port; without one, or whenever none has come for PollInterval seconds, the signal is read with AT+CSQ instead."""
+import time, threading
+from collections import deque
+import Iridium
+
+RfFailures = (10, 13, 17, 18, 32, 35)                                  # MO status codes a better sky view or a short wait can fix.
+
+class Scheduler(object):
+    """ Runs queued sessions in the first window with service and at least MinSigStr bars, backing off exponentially from BaseBackoff up to
+    MaxBackoff seconds after each session lost to an RF failure."""
+
+    def __init__(self, serialPort, MinSigStr=2, BaseBackoff=10, MaxBackoff=600, PollInterval=30):
+        self.serialPort = serialPort
+        self.MinSigStr = MinSigStr
+        self.BaseBackoff = BaseBackoff
+        self.MaxBackoff = MaxBackoff
+        self.PollInterval = PollInterval
+
+        self.signal = None                                              # Last +CIEV or AT+CSQ signal strength, 0-5.
+        self.signalTime = 0                                             # When the signal was last reported or polled for.
+        self.service = None                                             # Last +CIEV service indicator, 1 when network service is available.
+        self.failures = 0                                               # RF failures since the last successful session.
+        self.backoffUntil = 0
+        self.recentMoStatus = deque(maxlen=20)
+        self.sessions = deque()
+        self.condition = threading.Condition()
+
+        Iridium.Subscribe("+CIEV", self.OnIndicator)
+        Iridium.Subscribe("+SBDIX", self.OnSession)
+
+    def Close(self):
+        Iridium.Unsubscribe("+CIEV", self.OnIndicator)
+        Iridium.Unsubscribe("+SBDIX", self.OnSession)
+
+    def OnIndicator(self, serialPort, Code, Values):
+        if serialPort is not self.serialPort or len(Values) != 2:
+            return
+
+        with self.condition:
+            if Values[0] == 0:
+                self.signal = Values[1]
+                self.signalTime = time.time()
+            elif Values[0] == 1:
+                self.service = Values[1]
+            self.condition.notify_all()
+
+    def OnSession(self, serialPort, Code, Values):
+        if serialPort is not self.serialPort:
+            return
+
+        MOstatus = Values[0]
+
+        with self.condition:
+            self.recentMoStatus.append(MOstatus)
+
+            if MOstatus <= 8:
+                self.failures = 0
+                self.backoffUntil = 0
+            elif MOstatus in RfFailures:
+                self.failures += 1
+                backoff = min(self.MaxBackoff, self.BaseBackoff * 2 ** (self.failures - 1))
+                self.backoffUntil = time.time() + backoff
+                Iridium.Log("Scheduler: MO status " + str(MOstatus) + ", backing off " + str(backoff) + "s.")
+
+            self.condition.notify_all()
+
+    def IsGoodWindow(self):
+        """ True when a session now is worth trying."""
+        return self.service != 0 and self.signal is not None and self.signal >= self.MinSigStr and time.time() >= self.backoffUntil
+
+    def PollSignal(self):
+        """ Reads the signal with AT+CSQ. A failed read keeps the last known signal and is tried again after PollInterval seconds."""
+        signalStr = Iridium.CheckSignalStrength(self.serialPort)
+
+        with self.condition:
+            self.signalTime = time.time()
+            if signalStr is not None:
+                self.signal = signalStr
+            self.condition.notify_all()
+
+    def WaitForWindow(self, Timeout=None):
+        """ Drop in for WaitForSigStr. Blocks till IsGoodWindow() or Timeout seconds pass, returning which. Queries AT+CSQ whenever no
+        indicator report has been seen for PollInterval seconds."""
+        deadline = None if Timeout is None else time.time() + Timeout
+
+        while True:
+            if time.time() >= self.signalTime + self.PollInterval:
+                self.PollSignal()                                       # Not under the condition, so indicator reports aren't held up.
+
+            with self.condition:
+                if self.IsGoodWindow():
+                    return True
+
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    Iridium.Log("Scheduler.WaitForWindow() Timed Out. Signal: " + str(self.signal) + ", Service: " + str(self.service))
+                    return False
+
+                waits = [self.signalTime + self.PollInterval - now]     # Wake for the next poll, when the backoff ends or an indicator changes.
+                if self.backoffUntil > now:
+                    waits.append(self.backoffUntil - now)
+                if deadline is not None:
+                    waits.append(deadline - now)
+                self.condition.wait(max(0, min(waits)))
+
+    def Queue(self, Session):
+        """ Queues Session, a callable running an SBD session. It's retried in a later window while it returns False."""
+        with self.condition:
+            self.sessions.append(Session)
+            self.condition.notify_all()
+
+    def RunPending(self, Timeout=None):
+        """ Runs queued sessions as windows allow till the queue is empty or Timeout seconds pass. Returns the number still queued."""
+        deadline = None if Timeout is None else time.time() + Timeout
+
+        while self.sessions:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                break
+
+            if not self.WaitForWindow(remaining):
+                break
+
+            session = self.sessions[0]
+
+            if session() is False:
+                Iridium.Log("Scheduler: Session failed, will retry.")
+                with self.condition:
+                    if self.backoffUntil <= time.time():                # Failure the +SBDIX codes didn't cover, still don't retry straight away.
+                        self.backoffUntil = time.time() + self.BaseBackoff
+            else:
+                self.sessions.popleft()
+
+        return len(self.sessions)
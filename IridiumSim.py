@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+""" 9602 modem simulator on a pseudo-terminal, for exercising and benchmarking Iridium without hardware or a sky view.
+
+Covers the AT command set used by Iridium: AT, +CSQ, +CIER, +SBDMTA, +SBDAREG (and their ? queries), +SBDWT, +SBDWB, +SBDRT, +SBDRB, +SBDIX(A), +SBDSX,
++SBDD0/1/2 and +SBDTC, including chained commands and +CIEV / SBDRING unsolicited result codes.
+
+    sim = Simulator(Delays={"+SBDIX": 2}, Signal=lambda t: 5 if t % 60 < 40 else 1, MoStatus=[18, 32], MtQueue=["hello"])
+    sim.Start()
+    serialPort = Iridium.OpenSerial(sim.Port, 19200)
+
+Run on its own ("python IridiumSim.py") it prints the port name and serves it till interrupted."""
+import os, pty, select, signal, struct, threading, time, tty
+from collections import deque
+
+def Checksum(Payload):
+    return sum(bytearray(Payload)) & 0xFFFF
+
+class Simulator(object):
+    """ Delays maps a command ("AT", "+CSQ", "+SBDIX", ...) to seconds taken to answer it, plus "turnaround" for the time taken to start
+    on each command line however many commands it chains. Signal is a bar count 0-5 or a function of seconds
+    since Start() returning one. MoStatus is a sequence of MO status codes used by successive sessions, then 0, and a session without signal
+    fails with 32. MtQueue is the messages waiting at the gateway; more can be added with QueueMt()."""
+
+    def __init__(self, Delays=None, Signal=5, MoStatus=(), MtQueue=(), Echo=True):
+        self.Delays = dict(Delays or {})
+        self.Signal = Signal
+        self.moStatus = deque(MoStatus)
+        self.mtQueue = deque(MtQueue)
+        self.Echo = Echo
+
+        self.moBuffer = b""
+        self.mtBuffer = b""
+        self.momsn = 0
+        self.mtmsn = -1
+        self.ringAlert = False
+        self.ringEnabled = False
+        self.autoRegister = 0
+        self.indicators = False                                         # +CIER reporting on, with signal and service indicators.
+        self.cier = "0,0,0,0"
+        self.lastSignal = None
+        self.sessions = 0
+        self.commands = 0
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.Port = os.ttyname(self.slave)
+        self.input = b""
+        self.running = False
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def Start(self):
+        self.running = True
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.Run, name="IridiumSim")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def StartProcess(self):
+        """ Runs the simulator in a child process instead of a thread, so it doesn't count towards the caller's CPU time."""
+        self.running = True
+        self.started = time.time()
+        self.thread = None
+        self.pid = os.fork()
+
+        if self.pid == 0:
+            try:
+                self.Run()
+            finally:
+                os._exit(0)
+
+        return self
+
+    def Stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        else:
+            os.kill(self.pid, signal.SIGTERM)
+            os.waitpid(self.pid, 0)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def QueueMt(self, Message):
+        """ Queues an MT message at the gateway and sends SBDRING if ring alerts are enabled."""
+        with self.lock:
+            self.mtQueue.append(Message)
+            self.ringAlert = True
+            if self.ringEnabled:
+                self.Send("SBDRING\r\n")
+
+    def CurrentSignal(self):
+        return self.Signal(time.time() - self.started) if callable(self.Signal) else self.Signal
+
+    def Send(self, Data):
+        os.write(self.master, Data if isinstance(Data, bytes) else Data.encode("latin-1"))
+
+    def Run(self):
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.2)
+
+            if readable:
+                self.input += os.read(self.master, 1024)
+                while self.running and self.Process():
+                    pass
+
+            with self.lock:
+                self.ReportSignal()
+
+    def ReportSignal(self):
+        strength = self.CurrentSignal()
+        if self.indicators and strength != self.lastSignal:
+            self.Send("+CIEV:0,%d\r\n" % strength)
+            if self.lastSignal is None or (strength > 0) != (self.lastSignal > 0):
+                self.Send("+CIEV:1,%d\r\n" % (strength > 0))
+        self.lastSignal = strength
+
+    def Process(self):
+        """ Handles one complete command line from the input. Returns False when there isn't one yet."""
+        end = self.input.find(b"\r")
+        if end < 0:
+            return False
+
+        line = self.input[:end].decode("latin-1")
+        self.input = self.input[end + 1:]
+
+        if self.Echo:
+            self.Send(line + "\r")
+
+        line = line.strip()
+        if not line.upper().startswith("AT"):
+            return True
+
+        self.commands += 1
+        commands = [command.strip() for command in line[2:].split(";")] or [""]
+
+        with self.lock:
+            self.Delay("turnaround")
+
+            for command in commands:
+                reply = self.Command(command)
+                if reply is None:
+                    self.Send("\r\nERROR\r\n")
+                    return True
+                if reply:
+                    self.Send(reply)
+
+            if not line.upper().startswith(("AT+SBDWT", "AT+SBDWB", "AT+SBDRB")):
+                self.Send("\r\nOK\r\n")
+
+        return True
+
+    def Delay(self, Name):
+        delay = self.Delays.get(Name, 0)
+        if delay:
+            self.lock.release()                                         # Let QueueMt() and ReportSignal() carry on meanwhile.
+            try:
+                time.sleep(delay)
+            finally:
+                self.lock.acquire()
+
+    def Command(self, Command):
+        """ Runs one command, without its AT prefix. Returns the reply text before the final OK, or None for ERROR."""
+        name, _, argument = Command.upper().partition("=")
+        self.Delay(name or "AT")
+
+        if name == "":
+            return ""
+        elif name == "+CSQ":
+            return "\r\n+CSQ:%d\r\n" % self.CurrentSignal()
+        elif name == "+CIER":
+            values = (argument.split(",") + ["0"] * 4)[:4]
+            self.indicators = values[0] == "1"
+            self.cier = ",".join(values)
+            self.lastSignal = None
+            return ""
+        elif name == "+CIER?":
+            return "\r\n+CIER:%s\r\n" % self.cier
+        elif name == "+SBDMTA":
+            self.ringEnabled = argument == "1"
+            return ""
+        elif name == "+SBDMTA?":
+            return "\r\n+SBDMTA:%d\r\n" % self.ringEnabled
+        elif name == "+SBDAREG":
+            self.autoRegister = int(argument or 0)
+            return ""
+        elif name == "+SBDAREG?":
+            return "\r\n+SBDAREG:%d\r\n" % self.autoRegister
+        elif name == "+SBDWT":
+            self.ReadText()
+            return ""
+        elif name == "+SBDWB":
+            self.ReadBinary(int(argument))
+            return ""
+        elif name == "+SBDRT":
+            return "\r\n+SBDRT:\r\n" + self.mtBuffer.decode("latin-1") + "\r\n"
+        elif name == "+SBDRB":
+            self.Send(struct.pack(">H", len(self.mtBuffer)) + self.mtBuffer + struct.pack(">H", Checksum(self.mtBuffer)))
+            self.Send("\r\nOK\r\n")
+            return ""
+        elif name in ("+SBDIX", "+SBDIXA"):
+            return self.Session()
+        elif name == "+SBDSX":
+            return "\r\n+SBDSX: %d, %d, %d, %d, %d, %d\r\n" % (len(self.moBuffer) > 0, self.momsn, len(self.mtBuffer) > 0, self.mtmsn,
+                                                               self.ringAlert, len(self.mtQueue))
+        elif name in ("+SBDD0", "+SBDD1", "+SBDD2"):
+            if name != "+SBDD1":
+                self.moBuffer = b""
+            if name != "+SBDD0":
+                self.mtBuffer = b""
+            return "\r\n0\r\n"
+        elif name == "+SBDTC":
+            self.mtBuffer = self.moBuffer
+            return "\r\nSBDTC: Outbound SBD Copied to Inbound SBD: size = %d\r\n" % len(self.moBuffer)
+
+        return None
+
+    def ReadUntil(self, Length=None):
+        """ Reads the data phase of +SBDWT (to CR) or +SBDWB (Length bytes), leaving the lock free meanwhile."""
+        self.lock.release()
+        try:
+            deadline = time.time() + 60
+            while time.time() < deadline:
+                if Length is None and b"\r" in self.input:
+                    break
+                if Length is not None and len(self.input) >= Length:
+                    break
+                readable, _, _ = select.select([self.master], [], [], 0.2)
+                if readable:
+                    self.input += os.read(self.master, 1024)
+        finally:
+            self.lock.acquire()
+
+    def ReadText(self):
+        self.Send("\r\nREADY\r\n")
+        self.ReadUntil()
+
+        end = self.input.find(b"\r")
+        if end < 0:
+            self.Send("\r\n1\r\n\r\nOK\r\n")
+            return
+
+        self.moBuffer = self.input[:end]
+        self.input = self.input[end + 1:]
+        if self.Echo:
+            self.Send(self.moBuffer + b"\r")
+        self.Send("\r\n0\r\n\r\nOK\r\n")
+
+    def ReadBinary(self, Length):
+        self.Send("\r\nREADY\r\n")
+        self.ReadUntil(Length + 2)
+
+        if len(self.input) < Length + 2:
+            self.input = b""
+            self.Send("\r\n1\r\n\r\nOK\r\n")
+            return
+
+        payload, checksum = self.input[:Length], struct.unpack(">H", self.input[Length:Length + 2])[0]
+        self.input = self.input[Length + 2:]
+
+        if checksum != Checksum(payload):
+            self.Send("\r\n2\r\n\r\nOK\r\n")
+        elif not 1 <= Length <= 340:
+            self.Send("\r\n3\r\n\r\nOK\r\n")
+        else:
+            self.moBuffer = payload
+            self.Send("\r\n0\r\n\r\nOK\r\n")
+
+    def Session(self):
+        self.sessions += 1
+
+        if self.CurrentSignal() == 0:
+            moStatus = 32
+        elif self.moStatus:
+            moStatus = self.moStatus.popleft()
+        else:
+            moStatus = 0
+
+        if moStatus > 8:
+            return "\r\n+SBDIX: %d, %d, 2, 0, 0, %d\r\n" % (moStatus, self.momsn, len(self.mtQueue))
+
+        momsn = self.momsn
+        if self.moBuffer:
+            self.momsn += 1
+
+        mtStatus, mtLength = 0, 0
+        if self.mtQueue:
+            message = self.mtQueue.popleft()
+            self.mtBuffer = message if isinstance(message, bytes) else message.encode("latin-1")
+            self.mtmsn += 1
+            mtStatus, mtLength = 1, len(self.mtBuffer)
+        self.ringAlert = bool(self.mtQueue)
+
+        return "\r\n+SBDIX: %d, %d, %d, %d, %d, %d\r\n" % (moStatus, momsn, mtStatus, self.mtmsn if mtStatus else 0, mtLength, len(self.mtQueue))
+
+if __name__ == "__main__":
+    sim = Simulator(Delays={"+SBDIX": 2}).Start()
+    print("Simulated 9602 on " + sim.Port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.Stop()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+""" Message transport over RockBLOCK binary SBD. Packs several small queued messages into one MO payload, splits large ones into numbered
+fragments and reassembles MT payloads built the same way.
+
+Each payload is a magic byte, a 2-byte epoch and a run of records: {2-byte message id} {1-byte fragment index, top bit set on the last
+fragment} {2-byte length} {data}. The epoch is picked at random when a Transport starts, so message ids restarting at 0 after a reboot aren't
+taken for ones the receiver has already completed. An MT payload that isn't framed this way, such as text from the RockBLOCK console, is
+passed on whole as a message of its own."""
+import random, struct, time
+from collections import deque
+import Iridium
+
+PayloadHeader = struct.Struct(">BH")
+Header = struct.Struct(">HBH")
+Magic = 0xB1                                                            # Transport framing, version 1.
+LastFragment = 0x80
+MaxFragments = 0x80
+
+def UnpackRecords(Payload):
+    """ Splits a payload into its epoch and a list of (message id, fragment index, is last fragment, data) records. Returns None if it isn't
+    a transport payload: no magic byte, a truncated record or anything after the last record."""
+    payload = memoryview(Payload)
+    records = []
+
+    if len(payload) < PayloadHeader.size:
+        return None
+
+    magic, epoch = PayloadHeader.unpack_from(payload, 0)
+    if magic != Magic:
+        return None
+
+    offset = PayloadHeader.size
+    while offset < len(payload):
+        if offset + Header.size > len(payload):
+            return None
+
+        msgId, index, length = Header.unpack_from(payload, offset)
+        offset += Header.size
+
+        if offset + length > len(payload):
+            return None
+
+        records.append((msgId, index & ~LastFragment, bool(index & LastFragment), payload[offset:offset + length].tobytes()))
+        offset += length
+
+    return epoch, records
+
+class Reassembler(object):
+    """ Rebuilds messages from records arriving in any order, possibly more than once. Incomplete messages older than MaxAge seconds are dropped."""
+
+    def __init__(self, MaxAge=3600):
+        self.MaxAge = MaxAge
+        self.partial = {}                                               # (epoch, message id) -> [fragments by index, last index or None, first seen time]
+        self.completed = deque(maxlen=256)                              # Recently completed (epoch, id)s so a duplicate can't start them again.
+
+    def Add(self, Payload):
+        """ Adds a received payload and returns the list of messages it completed, or None if it isn't a transport payload."""
+        messages = []
+        now = time.time()
+
+        unpacked = UnpackRecords(Payload)
+        if unpacked is None:
+            return None
+
+        epoch, records = unpacked
+
+        for msgId, index, isLast, data in records:
+            msgId = (epoch, msgId)
+            if msgId in self.completed:
+                continue
+
+            entry = self.partial.setdefault(msgId, [{}, None, now])
+            entry[0].setdefault(index, data)                            # Duplicate fragments are ignored.
+            if isLast:
+                entry[1] = index
+
+            if entry[1] is not None and len(entry[0]) == entry[1] + 1:
+                fragments = entry[0]
+                messages.append(b"".join(fragments[i] for i in range(entry[1] + 1)))
+                del self.partial[msgId]
+                self.completed.append(msgId)
+
+        for msgId in [m for m, entry in self.partial.items() if now - entry[2] > self.MaxAge]:
+            Iridium.Log("Reassembler: Dropping incomplete message " + str(msgId) + ".")
+            del self.partial[msgId]
+
+        return messages
+
+class Transport(object):
+    """ Queues outgoing messages and moves them in as few SBD sessions as possible, reassembling any MT messages received on the way."""
+
+    def __init__(self, serialPort, MaxPayload=Iridium.MaxMoBytes, Epoch=None):
+        self.serialPort = serialPort
+        self.MaxPayload = MaxPayload
+        self.Epoch = random.randrange(0x10000) if Epoch is None else Epoch
+        self.FragmentSize = MaxPayload - PayloadHeader.size - Header.size     # Most data a record can carry.
+        self.outbound = deque()                                         # [message id, data, bytes sent, next fragment index]
+        self.pending = None                                             # Payload built but not yet delivered.
+        self.nextId = 0
+        self.reassembler = Reassembler()
+        self.sessions = 0
+
+    def Queue(self, Message):
+        """ Queues a bytes like message for sending. Returns its message id, or None if it is too big to fragment."""
+        data = memoryview(Message)
+
+        if len(data) > MaxFragments * self.FragmentSize:
+            Iridium.Log("Transport.Queue(): " + str(len(data)) + " byte message is too big.")
+            return None
+
+        msgId = self.nextId
+        self.nextId = (self.nextId + 1) & 0xFFFF
+        self.outbound.append([msgId, data, 0, 0])
+        return msgId
+
+    def NextPayload(self):
+        """ Builds the next MO payload from the head of the queue. A message is only fragmented when it won't fit whole in a payload of its own."""
+        payload = bytearray(PayloadHeader.pack(Magic, self.Epoch))
+        started = len(payload)
+
+        while self.outbound:
+            room = self.MaxPayload - len(payload) - Header.size
+            if room <= 0:
+                break
+
+            entry = self.outbound[0]
+            msgId, data, offset, index = entry
+            remaining = len(data) - offset
+
+            if remaining > room and len(payload) > started:
+                if remaining <= self.FragmentSize:
+                    break
+                if index + 1 + -(-(remaining - room) // self.FragmentSize) > MaxFragments:
+                    break                                               # Starting it here would need an index the header can't hold.
+
+            chunk = data[offset:offset + room]
+            isLast = offset + len(chunk) == len(data)
+
+            payload += Header.pack(msgId, index | (LastFragment if isLast else 0), len(chunk))
+            payload += chunk
+
+            if isLast:
+                self.outbound.popleft()
+            else:
+                entry[2] += len(chunk)
+                entry[3] += 1
+
+        return payload
+
+    def Flush(self, Budget=None):
+        """ Sends everything queued, one SBD session per payload. Returns the MT messages completed along the way. Stops early, keeping the
+        undelivered payload for the next call, if a payload can't be buffered or its sessions all fail. Budget is a RetryBudget shared by
+        every payload's sessions."""
+        received = []
+
+        while self.pending is not None or self.outbound:
+            if self.pending is None:
+                self.pending = self.NextPayload()
+
+            if not Iridium.BufferSbdBinary(self.serialPort, self.pending):
+                Iridium.Log("Transport.Flush(): Couldn't buffer payload, " + str(len(self.outbound)) + " messages still queued.")
+                break
+
+            delivered, messages = self.Session(Budget)
+            received.extend(messages)
+
+            if not delivered:
+                Iridium.Log("Transport.Flush(): Payload not delivered, " + str(len(self.outbound)) + " messages still queued.")
+                break
+
+            self.pending = None
+
+        return received
+
+    def Poll(self, Budget=None):
+        """ Mailbox check without sending anything. Returns the MT messages completed."""
+        Iridium.WriteAndCheck(self.serialPort, "AT+SBDD0\r", "0", 20)       # Clear the MO buffer so an old payload isn't sent again.
+        return self.Session(Budget)[1]
+
+    def Session(self, Budget=None):
+        """ Runs SBD sessions till the MO buffer goes or Budget runs out. Returns whether it went and the MT messages completed, with any MT
+        payload that isn't transport framed as a message in itself."""
+        received = []
+        self.sessions += 1
+
+        result = Iridium.InitiateSBD(self.serialPort, Binary=True, Budget=Budget)
+        for mtMsg in result:
+            messages = self.reassembler.Add(mtMsg)
+            if messages is None:
+                Iridium.Log("Transport: Passing on a " + str(len(mtMsg)) + " byte MT payload that isn't transport framed.")
+                messages = [bytes(mtMsg)]
+            received.extend(messages)
+
+        return result.Delivered is not None, received
@@ -0,0 +1,4 @@
+""" Settings for the tests, in place of the deployment's Globals."""
+import os, tempfile
+
+IridiumLog = os.path.join(tempfile.gettempdir(), "IridiumTest.log")
@@ -0,0 +1,22 @@
+""" Base for tests run against IridiumSim's simulated 9602."""
+import sys, time, unittest
+import Iridium, IridiumSim
+
+@unittest.skipIf(sys.version_info[0] > 2, "Iridium's serial paths are Python 2 only.")
+class SimulatorCase(unittest.TestCase):
+    Simulator = {}                                                      # Keyword arguments for IridiumSim.Simulator.
+
+    def setUp(self):
+        self.sim = IridiumSim.Simulator(**self.Simulator).Start()
+        self.serialPort = Iridium.OpenSerial(self.sim.Port, 19200)
+
+    def tearDown(self):
+        self.serialPort.close()
+        self.sim.Stop()
+
+    def Unread(self, Wait=0.2):
+        """ Whatever the modem has sent that no command has read, after Wait seconds for any late output."""
+        time.sleep(Wait)
+        rxBuffer = Iridium.GetRxBuffer(self.serialPort)
+        rxBuffer.Fill(0)
+        return bytes(rxBuffer.data).strip()
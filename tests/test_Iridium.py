@@ -0,0 +1,280 @@
+import json, logging, os, tempfile, threading, time, unittest
+import Globals, Iridium
+from SimulatorCase import SimulatorCase
+
+def Logged(Marker, Timeout=5):
+    """ The log file line holding Marker, once the log worker has written it, or None."""
+    deadline = time.time() + Timeout
+    while time.time() < deadline:
+        with open(Globals.IridiumLog) as logFile:
+            for line in logFile:
+                if Marker in line:
+                    return line.rstrip("\n")
+        time.sleep(0.05)
+    return None
+
+class FullQueue(Iridium.Queue.Queue):
+    """ Log queue that's always full and never has anything to give the log worker."""
+
+    def put_nowait(self, Item):
+        raise Iridium.Queue.Full
+
+    def get(self, block=True, timeout=None):
+        time.sleep(min(timeout or 0.1, 0.1))
+        raise Iridium.Queue.Empty
+
+class LogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.marker = "LogTest %f" % time.time()
+
+    def testLevelFilter(self):
+        Iridium.SetLogLevel(logging.INFO)
+        try:
+            Iridium.Log(self.marker + " debug")
+            Iridium.Log(self.marker + " info", logging.INFO)
+        finally:
+            Iridium.SetLogLevel(logging.DEBUG)
+
+        self.assertIsNotNone(Logged(self.marker + " info"))
+        self.assertIsNone(Logged(self.marker + " debug", 0))           # Written in order, so it would be there by now.
+
+    def testArgsFormattedByWorker(self):
+        Iridium.Log(self.marker + " %s %d", Args=("args", 5))
+        self.assertTrue(Logged(self.marker).endswith(self.marker + " args 5"))
+
+    def testRateLimit(self):
+        message = self.marker + " limited"
+        for _ in range(3):
+            Iridium.Log(message, RateLimit=True)
+        Iridium.LogRepeats[message][0] -= Iridium.RepeatWindow             # The window has passed.
+        Iridium.Log(message, RateLimit=True)
+
+        self.assertTrue(Logged(message + " (repeated 2 times)"))
+        with open(Globals.IridiumLog) as logFile:
+            self.assertEqual(sum(line.rstrip("\n").endswith(message) for line in logFile), 1)
+
+    def testRateLimitFromManyThreads(self):
+        message = self.marker + " threads"
+        threads = [threading.Thread(target=lambda: [Iridium.Log(message, RateLimit=True) for _ in range(200)]) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Iridium.LogRepeats[message][1], 8 * 200 - 1)
+
+    def testDroppedWhenQueueFull(self):
+        logQueue = Iridium.LogQueue
+        Iridium.LogQueue = FullQueue()
+        try:
+            for _ in range(3):
+                Iridium.Log(self.marker + " dropped")
+            self.assertEqual(Iridium.LogDropped[0], 3)
+        finally:
+            Iridium.LogQueue = logQueue
+
+        Iridium.Log(self.marker + " after")
+        self.assertTrue(Logged(self.marker + " after (3 log messages dropped, queue full)"))
+        self.assertIsNone(Logged(self.marker + " dropped", 0))
+
+class WriteAndCheckTest(SimulatorCase):
+
+    def testNumericResultReadsThroughOk(self):
+        self.assertTrue(Iridium.WriteAndCheck(self.serialPort, "AT+SBDD0\r", "0", 20))
+        self.assertEqual(self.Unread(), "")
+
+    def testTextBufferReadsThroughOk(self):
+        self.assertTrue(Iridium.BufferSbdMessage(self.serialPort, "Antenna status"))
+        self.assertEqual(self.Unread(), "")
+
+    def testBinaryBufferReadsThroughOk(self):
+        self.assertTrue(Iridium.BufferSbdBinary(self.serialPort, b"\x00\x01\x02"))
+        self.assertEqual(self.Unread(), "")
+
+class ParseReplyTest(unittest.TestCase):
+
+    def testTypedRecord(self):
+        self.assertEqual(Iridium.ParseReply("+SBDIX: 0, 12, 1, 3, 5, 2"), Iridium.SbdixReply(0, 12, 1, 3, 5, 2))
+        self.assertEqual(Iridium.ParseReply("+CSQ:4"), Iridium.CsqReply(4))
+
+    def testUnparsable(self):
+        self.assertIsNone(Iridium.ParseReply("OK"))
+        self.assertIsNone(Iridium.ParseReply("+SBDIX: 0, 12"))
+        self.assertIsNone(Iridium.ParseReply("+CSQ: x"))
+
+class ReadReplyTest(SimulatorCase):
+
+    def testReadsThroughOk(self):
+        Iridium.SerialWrite(self.serialPort, "AT+CSQ\r")
+        self.assertEqual(Iridium.ReadReply(self.serialPort, "AT+CSQ\r", "+CSQ", 5), Iridium.CsqReply(5))
+        self.assertEqual(self.Unread(), b"")
+
+    def testSkipsUnsolicited(self):
+        Iridium.WriteAndCheck(self.serialPort, "AT+SBDMTA=1\r", "OK", 5)
+        self.sim.QueueMt("hello")                                       # SBDRING comes before the reply.
+        time.sleep(0.1)
+        Iridium.SerialWrite(self.serialPort, "AT+SBDSX\r")
+        self.assertEqual(Iridium.ReadReply(self.serialPort, "AT+SBDSX\r", "+SBDSX", 5).RaFlag, 1)
+
+class LegacyReadersTest(SimulatorCase):
+
+    def testWriteAndReceive(self):
+        self.assertEqual(Iridium.WriteAndReceive(self.serialPort, "AT+CSQ\r", "+CSQ:", "\r", 5), "+CSQ:5\r")
+        self.assertEqual(self.Unread(), b"")
+
+    def testReadToEndOfMessageStopsAtError(self):
+        Iridium.SerialWrite(self.serialPort, "AT+BOGUS\r")
+        self.assertIsNone(Iridium.ReadToEndOfMessage(self.serialPort, "\r", "+CSQ:", 5))
+
+    def testCheckForReply(self):
+        Iridium.SerialWrite(self.serialPort, "AT\r")
+        self.assertTrue(Iridium.CheckForReply(self.serialPort, "OK", 5))
+        Iridium.SerialWrite(self.serialPort, "AT+BOGUS\r")
+        self.assertFalse(Iridium.CheckForReply(self.serialPort, "OK", 5))
+
+class TimeoutPolicyTest(unittest.TestCase):
+
+    def testLearnsFromReplyTimes(self):
+        timeouts = Iridium.TimeoutPolicy()
+        for _ in range(12):
+            timeouts.Observe("AT+CSQ\r", 0.3)
+        self.assertAlmostEqual(timeouts.Timeout("AT+CSQ\r", 40), 2.45)
+
+        timeouts.Observe("AT+CSQ\r", 0, TimedOut=True)
+        self.assertEqual(timeouts.Timeout("AT+CSQ\r", 40), 40)
+
+    def testSessionTimeoutIsNeverCut(self):
+        timeouts = Iridium.TimeoutPolicy()
+        for _ in range(12):
+            timeouts.Observe("AT+SBDIX\r", 0.3)
+        self.assertEqual(timeouts.Timeout("AT+SBDIX\r", 60), 60)
+        self.assertEqual(timeouts.Snapshot(), {})
+
+class RetryBudgetTest(unittest.TestCase):
+
+    def testBacksOffTillASessionNoLongerFits(self):
+        budget = Iridium.RetryBudget(MaxSeconds=100, BaseDelay=5)
+        self.assertEqual([budget.Failed() for _ in range(4)], [5, 10, 20, None])     # 40s wait + a 60s session is more than is left.
+
+    def testMaxAttempts(self):
+        budget = Iridium.RetryBudget(MaxAttempts=2, MaxSeconds=None)
+        self.assertEqual([budget.Failed() for _ in range(2)], [5, None])
+
+class StateFileTest(unittest.TestCase):
+
+    class Port(object):
+        port = "/dev/test"
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "state.json")
+        self.saveDelay = Iridium.SaveDelay
+        Iridium.SaveDelay = 0.2
+        Iridium.SetStateFile(self.path)
+
+    def tearDown(self):
+        Iridium.SetStateFile(None)
+        Iridium.SaveDelay = self.saveDelay
+        Iridium.ModemStates.clear()
+
+    def testUpdatesAreWrittenOnceLater(self):
+        state = Iridium.GetModemState(self.Port())
+        state.Update(moFlag=1)
+        state.Update(moMsn=7)
+        self.assertFalse(os.path.exists(self.path))                    # Nothing written on the caller's thread.
+
+        time.sleep(0.5)
+        with open(self.path) as stateFile:
+            saved = json.load(stateFile)["/dev/test"]
+        self.assertEqual((saved["moFlag"], saved["moMsn"]), (1, 7))
+
+class SessionTimeoutTest(SimulatorCase):
+    Simulator = {"Delays": {"+SBDIX": 0.3}}
+
+    def setUp(self):
+        SimulatorCase.setUp(self)
+        self.timeouts = Iridium.Timeouts
+        Iridium.Timeouts = Iridium.TimeoutPolicy()
+
+    def tearDown(self):
+        Iridium.Timeouts = self.timeouts
+        SimulatorCase.tearDown(self)
+
+    def testSlowSessionIsNotAbandoned(self):
+        for _ in range(12):                                             # Enough quick sessions to learn a timeout from.
+            Iridium.InitiateSBD(self.serialPort)
+
+        self.sim.Delays["+SBDIX"] = 3
+        momsn = self.sim.momsn
+        self.assertTrue(Iridium.BufferSbdMessage(self.serialPort, "Antenna status"))
+        Iridium.InitiateSBD(self.serialPort)
+
+        self.assertEqual(self.sim.momsn, momsn + 1)                     # Sent once.
+
+class DeliveredOnceTest(SimulatorCase):
+
+    def Send(self, Message):
+        momsn = self.sim.momsn
+        self.assertTrue(Iridium.BufferSbdMessage(self.serialPort, Message))
+        Iridium.InitiateSBD(self.serialPort)
+        self.assertEqual(self.sim.momsn, momsn + 1)
+
+    def testMailboxCheckAfterSendDoesNotResend(self):
+        self.Send("status 1")
+        self.sim.QueueMt("hello")
+        self.assertEqual(Iridium.InitiateSBD(self.serialPort), ["hello"])
+        self.assertEqual(self.sim.momsn, 1)
+
+    def testRingAlertAfterSendDoesNotResend(self):
+        received = []
+        self.assertTrue(Iridium.EnableRing(self.serialPort))
+        dispatcher = Iridium.Dispatcher(self.serialPort, OnMessage=lambda MTmsn, mtMsg: received.append(mtMsg))
+        dispatcher.Start()
+
+        try:
+            self.Send("status 1")
+            self.sim.QueueMt("hello")
+            deadline = time.time() + 10
+            while not received and time.time() < deadline:
+                time.sleep(0.1)
+        finally:
+            dispatcher.Stop()
+
+        self.assertEqual(received, ["hello"])
+        self.assertEqual(self.sim.momsn, 1)
+
+class SessionResultTest(SimulatorCase):
+    Simulator = {"MoStatus": [18, 18, 0], "MtQueue": ["hello"]}
+
+    def testDelivered(self):
+        self.assertTrue(Iridium.BufferSbdMessage(self.serialPort, "Antenna status"))
+        result = Iridium.InitiateSBD(self.serialPort, Budget=Iridium.RetryBudget(MaxSeconds=None, BaseDelay=0.1))
+
+        self.assertEqual(result, ["hello"])
+        self.assertEqual([reply.MOstatus for reply in result.Replies], [18, 18, 0])
+        self.assertEqual(result.Delivered.MOmsn, 0)
+
+    def testNotDeliveredOnceBudgetRunsOut(self):
+        self.assertTrue(Iridium.BufferSbdMessage(self.serialPort, "Antenna status"))
+        result = Iridium.InitiateSBD(self.serialPort, Budget=Iridium.RetryBudget(MaxAttempts=2, BaseDelay=0.1))
+
+        self.assertEqual(len(result.Replies), 2)
+        self.assertIsNone(result.Delivered)
+
+class MtBacklogTest(SimulatorCase):
+    Simulator = {"MtQueue": ["one", "two", "three"]}
+
+    def testDrainIsNotCutShortByTheBudget(self):
+        exhausted = []
+        onExhausted = lambda serialPort, Code, Values: exhausted.append(Values)
+        Iridium.Subscribe("EXHAUSTED", onExhausted)
+        try:
+            result = Iridium.InitiateSBD(self.serialPort, Budget=Iridium.RetryBudget(MaxSeconds=1))   # Too little left for another session.
+        finally:
+            Iridium.Unsubscribe("EXHAUSTED", onExhausted)
+
+        self.assertEqual(result, ["one", "two", "three"])
+        self.assertEqual(exhausted, [])
+
+if __name__ == "__main__":
+    unittest.main()
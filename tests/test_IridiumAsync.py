@@ -0,0 +1,44 @@
+import sys, time, unittest
+import IridiumSim
+if sys.version_info[0] > 2:                                             # IridiumAsync is Python 3 syntax.
+    import asyncio, IridiumAsync
+
+@unittest.skipIf(sys.version_info[0] < 3, "IridiumAsync is Python 3 only.")
+class AsyncModemTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = IridiumSim.Simulator().Start()
+        self.loop = asyncio.new_event_loop()
+        self.modem = self.Run(IridiumAsync.AsyncModem.Open(self.sim.Port, 19200))
+
+    def tearDown(self):
+        self.modem.Close()
+        self.loop.close()
+        self.sim.Stop()
+
+    def Run(self, Coroutine):
+        return self.loop.run_until_complete(Coroutine)
+
+    def Unread(self):
+        time.sleep(0.2)
+        self.modem.OnReadable()
+        return bytes(self.modem.data).strip()
+
+    def testNumericResultReadsThroughOk(self):
+        self.assertTrue(self.Run(self.modem.WriteAndCheck("AT+SBDD0\r", "0", 20)))
+        self.assertEqual(self.Unread(), b"")
+
+    def testBufferReadsThroughOk(self):
+        self.assertTrue(self.Run(self.modem.BufferSbdMessage("Antenna status")))
+        self.assertTrue(self.Run(self.modem.BufferSbdBinary(b"\x00\x01\x02")))
+        self.assertEqual(self.Unread(), b"")
+
+    def testMailboxCheckAfterSendDoesNotResend(self):
+        self.assertTrue(self.Run(self.modem.BufferSbdMessage("status 1")))
+        self.assertEqual(self.Run(self.modem.InitiateSBD()).Delivered.MOmsn, 0)
+        self.sim.QueueMt("hello")
+        self.assertEqual(self.Run(self.modem.InitiateSBD()), ["hello"])
+        self.assertEqual(self.sim.momsn, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from IridiumCodec import CodecError, Choice, Decoder, Encoder, Fixed, Flag, Int, Schema, Text
+
+def Report(Azimuth, Locked=True, Mode="track"):
+    return {"azimuth": Azimuth, "offset": -3, "locked": Locked, "mode": Mode, "note": "ok"}
+
+class CodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = Schema(1, [Fixed("azimuth", 0, 360, 0.1, DeltaBits=6), Int("offset", 8), Flag("locked"),
+                                 Choice("mode", ["idle", "track", "stow"]), Text("note", ["ok", "fault"])])
+        self.encoder = Encoder(self.schema)
+        self.decoder = Decoder([self.schema])
+
+    def testRoundTrip(self):
+        reports = [Report(10.5), Report(10.7, Mode="stow"), Report(200, Locked=False)]
+        self.assertEqual(self.decoder.Decode(self.encoder.Encode(reports)), reports)
+
+    def testFreeText(self):
+        report = dict(Report(1), note=u"h\u00e9llo")
+        self.assertEqual(self.decoder.Decode(self.encoder.Encode([report])), [report])
+
+    def testDeltaAgainstAcknowledgedBase(self):
+        report = dict(Report(10), note="pointing at the horizon")
+        first = self.encoder.Encode([report], Msn=5)
+        self.decoder.Decode(first, 5)
+        self.encoder.Ack(5)
+
+        report = dict(report, azimuth=10.2)
+        second = self.encoder.Encode([report], Msn=6)
+        self.assertLess(len(second), len(first))
+        self.assertEqual(self.decoder.Decode(second, 6), [report])
+
+    def testUnacknowledgedIsNotBase(self):
+        self.encoder.Encode([Report(10)], Msn=5)                        # Never delivered.
+        self.assertEqual(self.decoder.Decode(self.encoder.Encode([Report(11)])), [Report(11)])
+
+    def testUnknownBase(self):
+        self.encoder.Encode([Report(10)], Msn=5)
+        self.encoder.Ack(5)
+        self.assertRaises(CodecError, self.decoder.Decode, self.encoder.Encode([Report(11)]))
+
+    def testFit(self):
+        encoder = Encoder(self.schema, MaxBytes=12)
+        reports = [Report(azimuth * 30) for azimuth in range(10)]
+
+        payload, count = encoder.Fit(reports)
+        self.assertTrue(0 < count < len(reports))
+        self.assertLessEqual(len(payload), 12)
+        self.assertEqual(self.decoder.Decode(payload), reports[:count])
+        self.assertRaises(CodecError, encoder.Encode, reports)
+
+    def testBadValues(self):
+        self.assertRaises(CodecError, self.encoder.Encode, [Report(1, Mode="park")])
+        self.assertRaises(CodecError, self.encoder.Encode, [dict(Report(1), offset=200)])
+        self.assertRaises(CodecError, self.decoder.Decode, b"\x04")
+        self.assertRaises(CodecError, Decoder([]).Decode, self.encoder.Encode([Report(1)]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading, time, unittest
+import zmq
+import Iridium, IridiumDaemon, IridiumTransport
+from SimulatorCase import SimulatorCase
+
+class DaemonTest(SimulatorCase):
+
+    def setUp(self):
+        SimulatorCase.setUp(self)
+        self.daemon = IridiumDaemon.Daemon(Iridium.OpenSerial(self.sim.Port, 19200), "inproc://IridiumRouter", "inproc://IridiumPub",
+                                           MaxBacklog=3, BatchDelay=0.5)
+        self.thread = threading.Thread(target=self.daemon.Run)
+        self.thread.start()
+
+        context = zmq.Context.instance()
+        self.sub = context.socket(zmq.SUB)
+        self.sub.setsockopt(zmq.SUBSCRIBE, b"")
+        self.sub.connect("inproc://IridiumPub")
+        self.client = context.socket(zmq.REQ)
+        self.client.setsockopt(zmq.IDENTITY, b"alpha")
+        self.client.connect("inproc://IridiumRouter")
+
+    def tearDown(self):
+        self.daemon.Stop()
+        self.thread.join()
+        self.daemon.Close()
+        self.sub.close(0)
+        self.client.close(0)
+        SimulatorCase.tearDown(self)
+
+    def Request(self, *Frames):
+        self.client.send_multipart(list(Frames))
+        return self.client.recv_multipart()
+
+    def Published(self, Topic, Count, Timeout=15):
+        """ The first Count messages published with Topic."""
+        messages = []
+        deadline = time.time() + Timeout
+        while len(messages) < Count and self.sub.poll(max(0, deadline - time.time()) * 1000):
+            frames = self.sub.recv_multipart()
+            if frames[0] == Topic:
+                messages.append(frames)
+        return messages
+
+    def testBatchesAndConfirms(self):
+        for i in range(3):
+            self.assertEqual(self.Request(b"SEND", b"status %d" % i), [b"QUEUED", str(i).encode("ascii")])
+        self.assertEqual(self.Request(b"SEND", b"status 3")[0], b"BUSY")
+
+        confirmations = self.Published(b"DELIVERED", 3)
+        self.assertEqual([frames[1:3] for frames in confirmations], [[b"alpha", b"0"], [b"alpha", b"1"], [b"alpha", b"2"]])
+        self.assertEqual((self.sim.sessions, self.sim.momsn), (1, 1))  # One session carried all three, once.
+
+    def testPublishesMtMessages(self):
+        sender = IridiumTransport.Transport(None)
+        sender.Queue(b"hello")
+        self.sim.QueueMt(bytes(sender.NextPayload()))
+
+        self.assertEqual(self.Published(b"MT", 1), [[b"MT", b"hello"]])
+
+    def testPublishesUnframedMtPayloads(self):
+        self.sim.QueueMt("hello from the console")
+
+        self.assertEqual(self.Published(b"MTRAW", 1), [[b"MTRAW", b"hello from the console"]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import json, time, unittest
+import zmq
+import Iridium, IridiumMetrics
+from SimulatorCase import SimulatorCase
+
+class HistogramTest(unittest.TestCase):
+
+    def testPercentiles(self):
+        histogram = IridiumMetrics.Histogram()
+        for seconds in [0.05] * 98 + [3, 120]:
+            histogram.Add(seconds)
+
+        snapshot = histogram.Snapshot()
+        self.assertEqual((snapshot["p50"], snapshot["p99"]), (0.1, 5))
+        self.assertEqual(histogram.Percentile(100), 120)
+
+    def testEmpty(self):
+        self.assertIsNone(IridiumMetrics.Histogram().Snapshot()["p99"])
+
+class RecordingTest(SimulatorCase):
+    Simulator = {"MtQueue": ["hello"]}
+
+    def setUp(self):
+        SimulatorCase.setUp(self)
+        IridiumMetrics.metrics.Reset()
+
+        context = zmq.Context.instance()
+        self.sub = context.socket(zmq.PAIR)
+        self.sub.bind("inproc://IridiumMetricsTest")
+        self.pub = context.socket(zmq.PAIR)
+        self.pub.connect("inproc://IridiumMetricsTest")
+
+    def tearDown(self):
+        Iridium.SetZmqSock(None)
+        time.sleep(0.2)                                                 # Let the log worker finish with the socket.
+        self.pub.close(0)
+        self.sub.close(0)
+        SimulatorCase.tearDown(self)
+
+    def testCommandsAndSessionsAreRecorded(self):
+        self.assertTrue(Iridium.WriteAndCheck(self.serialPort, "AT\r", "OK", 5))
+        self.assertTrue(Iridium.WaitForSigStr(self.serialPort, 2, 10))
+        self.assertEqual(Iridium.InitiateSBD(self.serialPort), ["hello"])
+
+        snapshot = IridiumMetrics.Snapshot()
+        for name in ("AT", "AT+CSQ", "WaitForSigStr", "AT+SBDIX", "InitiateSBD"):
+            self.assertEqual(snapshot["timings"][name]["failed"], 0, name)
+            self.assertGreaterEqual(snapshot["timings"][name]["n"], 1, name)
+        self.assertEqual(snapshot["counters"]["sessions"], 1)
+        self.assertEqual(snapshot["mtStatus"], {"1": 1})
+        self.assertEqual(snapshot["signal"][5], 1)
+
+    def testPublishedOnTheZmqSocket(self):
+        interval = IridiumMetrics.Interval
+        IridiumMetrics.Interval = 0.1
+        Iridium.SetZmqSock(self.pub)
+        try:
+            Iridium.WriteAndCheck(self.serialPort, "AT\r", "OK", 5)
+            frames = None
+            deadline = time.time() + 5
+            while self.sub.poll(max(0, deadline - time.time()) * 1000):
+                frames = self.sub.recv_multipart()
+                if frames[0] == b"IridiumMetrics":
+                    break
+                Iridium.Log("Waking the log worker.")
+        finally:
+            IridiumMetrics.Interval = interval
+
+        self.assertEqual(frames[0], b"IridiumMetrics")
+        self.assertEqual(json.loads(frames[1].decode("utf-8"))["timings"]["AT"]["n"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
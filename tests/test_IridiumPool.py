@@ -0,0 +1,57 @@
+import unittest
+import IridiumPool
+from SimulatorCase import SimulatorCase
+
+class PoolTest(SimulatorCase):
+
+    def setUp(self):
+        SimulatorCase.setUp(self)
+        self.pool = IridiumPool.Pool([self.sim.Port])
+
+    def tearDown(self):
+        self.pool.Close()
+        SimulatorCase.tearDown(self)
+
+    def testRingAlertAfterSendDoesNotResend(self):
+        self.assertEqual(self.pool.Send("status 1").Result(30), self.sim.Port)
+        self.sim.QueueMt("hello")
+
+        self.assertEqual(self.pool.Receive(10)[2], "hello")
+        self.assertEqual(self.sim.momsn, 1)
+
+    def testFailedSessionGoesBackInTheQueue(self):
+        self.pool.BaseRest = 0.5
+        self.sim.moStatus.extend([18])
+
+        self.assertEqual(self.pool.Send("status 1").Result(30), self.sim.Port)
+        self.assertEqual(self.pool.Status()[self.sim.Port]["sessions"], 2)
+        self.assertEqual(self.sim.momsn, 1)
+
+    def testUndeliverableMessageFails(self):
+        self.pool.BaseRest = 0.1
+        self.pool.MaxAttempts = 2
+        self.sim.moStatus.extend([18, 18])
+
+        self.assertRaises(IridiumPool.SendError, self.pool.Send("status 1").Result, 30)
+        self.assertEqual(self.pool.Status()[self.sim.Port]["faults"], 0)
+
+class BinaryPoolTest(SimulatorCase):
+
+    def setUp(self):
+        SimulatorCase.setUp(self)
+        self.pool = IridiumPool.Pool([self.sim.Port], Binary=True)
+
+    def tearDown(self):
+        self.pool.Close()
+        SimulatorCase.tearDown(self)
+
+    def testOversizedMessageDoesNotStallTheQueue(self):
+        tooBig = self.pool.Send(b"x" * 400)
+        ok = self.pool.Send(b"ok")
+
+        self.assertRaises(IridiumPool.SendError, tooBig.Result, 1)
+        self.assertEqual(ok.Result(30), self.sim.Port)
+        self.assertEqual(self.pool.Status()[self.sim.Port]["faults"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
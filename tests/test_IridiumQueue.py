@@ -0,0 +1,71 @@
+import threading, unittest
+import Iridium, IridiumQueue
+from SimulatorCase import SimulatorCase
+
+class OutboundQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = IridiumQueue.OutboundQueue(":memory:")
+
+    def tearDown(self):
+        self.queue.Close()
+
+    def testAckWrapsRound(self):
+        msgId = self.queue.Put(b"status")
+        self.queue.MarkInFlight(msgId, 65535)
+
+        self.assertFalse(self.queue.Ack(65534))
+        self.assertTrue(self.queue.Ack(0))                              # Reply lost, resent by the retry as MOMSN 0.
+        self.assertEqual(len(self.queue), 0)
+
+    def testRecoverWrapsRound(self):
+        sent = self.queue.Put(b"sent")
+        unsent = self.queue.Put(b"unsent")
+        self.queue.MarkInFlight(sent, 65535)
+        self.queue.MarkInFlight(unsent, 0)
+
+        self.queue.Recover(0)
+        self.assertEqual(self.queue.Next(), (unsent, b"unsent"))
+        self.assertEqual(len(self.queue), 1)
+
+    def testAtOrAfter(self):
+        self.assertTrue(IridiumQueue.AtOrAfter(5, 5))
+        self.assertTrue(IridiumQueue.AtOrAfter(1, 65535))
+        self.assertFalse(IridiumQueue.AtOrAfter(65535, 1))
+
+class QueueSendTest(SimulatorCase):
+    Simulator = {"Delays": {"+SBDIX": 0.3}}
+
+    def setUp(self):
+        SimulatorCase.setUp(self)
+        self.queue = IridiumQueue.OutboundQueue(":memory:")
+
+    def tearDown(self):
+        self.queue.Close()
+        SimulatorCase.tearDown(self)
+
+    def testSendsEachMessageOnce(self):
+        self.queue.Put("first")
+        self.queue.Put("second")
+        self.queue.Send(self.serialPort)
+
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.sim.momsn, 2)
+
+    def testLostReplyIsNotSentAgain(self):
+        sessionTimeout = Iridium.SessionTimeout
+        Iridium.SessionTimeout = 1
+        self.sim.Delays["+SBDIX"] = 2                                   # The first session's reply comes too late.
+        threading.Timer(0.5, self.sim.Delays.update, [{"+SBDIX": 0}]).start()
+
+        try:
+            self.queue.Put("status")
+            self.queue.Send(self.serialPort)
+        finally:
+            Iridium.SessionTimeout = sessionTimeout
+
+        self.assertEqual(self.sim.momsn, 1)                             # Sent by the lost session only.
+        self.assertEqual(len(self.queue), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import time, unittest
+import Iridium, IridiumScheduler
+from SimulatorCase import SimulatorCase
+
+class SchedulerRetryTest(SimulatorCase):
+    Simulator = {"MoStatus": [15, 15, 15]}                              # Access denied, which the link estimate doesn't cover.
+
+    def setUp(self):
+        SimulatorCase.setUp(self)
+        self.scheduler = IridiumScheduler.Scheduler(self.serialPort)
+
+    def tearDown(self):
+        self.scheduler.Close()
+        SimulatorCase.tearDown(self)
+
+    def testBacksOffBeforeWaitingForWindow(self):
+        budget = Iridium.RetryBudget(MaxAttempts=3, MaxSeconds=None, BaseDelay=0.2)
+        started = time.time()
+        Iridium.InitiateSBD(self.serialPort, Scheduler=self.scheduler, Budget=budget)
+
+        self.assertEqual(self.sim.sessions, 3)
+        self.assertGreaterEqual(time.time() - started, 0.2 + 0.4)
+
+class SchedulerPollTest(SimulatorCase):
+    Simulator = {"Signal": lambda t: 0 if t < 0.5 else 5}
+
+    def testPollsWithoutIndicatorReports(self):
+        scheduler = IridiumScheduler.Scheduler(self.serialPort, PollInterval=0.2)
+        try:
+            self.assertTrue(scheduler.WaitForWindow(5))
+        finally:
+            scheduler.Close()
+
+        self.assertEqual(scheduler.signal, 5)
+
+if __name__ == "__main__":
+    unittest.main()
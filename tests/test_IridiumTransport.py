@@ -0,0 +1,88 @@
+import unittest
+import Iridium, IridiumTransport
+from SimulatorCase import SimulatorCase
+
+def Payloads(Sender):
+    payloads = []
+    while Sender.outbound:
+        payloads.append(bytes(Sender.NextPayload()))
+    return payloads
+
+class TransportTest(unittest.TestCase):
+
+    def testPacksSmallMessages(self):
+        sender = IridiumTransport.Transport(None, MaxPayload=100)
+        sender.Queue(b"one")
+        sender.Queue(b"two")
+
+        payloads = Payloads(sender)
+        self.assertEqual(len(payloads), 1)
+        self.assertEqual(IridiumTransport.Reassembler().Add(payloads[0]), [b"one", b"two"])
+
+    def testFragments(self):
+        sender = IridiumTransport.Transport(None, MaxPayload=20)
+        message = bytes(bytearray(range(100)))
+        sender.Queue(message)
+
+        receiver = IridiumTransport.Reassembler()
+        received = []
+        for payload in reversed(Payloads(sender)):                      # Any order will do.
+            received.extend(receiver.Add(payload))
+            received.extend(receiver.Add(payload))                      # Duplicates are dropped.
+        self.assertEqual(received, [message])
+
+    def testLargestMessage(self):
+        sender = IridiumTransport.Transport(None)
+        message = b"x" * (IridiumTransport.MaxFragments * sender.FragmentSize)
+        sender.Queue(b"small")
+        sender.Queue(message)
+
+        receiver = IridiumTransport.Reassembler()
+        received = []
+        for payload in Payloads(sender):
+            received.extend(receiver.Add(payload))
+        self.assertEqual(received, [b"small", message])
+
+    def testSenderRestart(self):
+        receiver = IridiumTransport.Reassembler()
+        before = IridiumTransport.Transport(None, Epoch=1)
+        before.Queue(b"before")
+        self.assertEqual(receiver.Add(Payloads(before)[0]), [b"before"])
+
+        after = IridiumTransport.Transport(None, Epoch=2)               # Message ids start at 0 again.
+        after.Queue(b"after")
+        self.assertEqual(receiver.Add(Payloads(after)[0]), [b"after"])
+
+    def testRejectsForeignPayloads(self):
+        sender = IridiumTransport.Transport(None, Epoch=1)
+        sender.Queue(b"status")
+        payload = Payloads(sender)[0]
+
+        for foreign in (b"hello from the console", payload[:-1], payload + b"\x00", b"\xb1"):
+            self.assertIsNone(IridiumTransport.UnpackRecords(foreign))
+            self.assertIsNone(IridiumTransport.Reassembler().Add(foreign))
+
+class FlushTest(SimulatorCase):
+    Simulator = {"MoStatus": [18]}
+
+    def testKeepsUndeliveredPayload(self):
+        transport = IridiumTransport.Transport(self.serialPort)
+        transport.Queue(b"status")
+
+        transport.Flush(Budget=Iridium.RetryBudget(MaxAttempts=1))
+        self.assertIsNotNone(transport.pending)
+        self.assertEqual(self.sim.momsn, 0)
+
+        transport.Flush()
+        self.assertIsNone(transport.pending)
+        self.assertEqual(self.sim.momsn, 1)
+
+class UnframedMtTest(SimulatorCase):
+    Simulator = {"MtQueue": ["hello from the console"]}
+
+    def testPassedOnWhole(self):
+        transport = IridiumTransport.Transport(self.serialPort)
+        self.assertEqual(transport.Poll(), [b"hello from the console"])
+
+if __name__ == "__main__":
+    unittest.main()